@@ -0,0 +1,135 @@
+"""Columnar OHLCV bars, shared by crawl.py (fetch, derive, write) and
+reader.py (bulk reads)."""
+
+import numpy as np
+import pandas as pd
+
+MARKET_TZ = "Asia/Ho_Chi_Minh"
+# Vietnam has no DST, so local session buckets are a fixed shift from UTC.
+MARKET_UTC_OFFSET = np.timedelta64(7, "h")
+
+# Prices are numeric(10,2); anything closer than this is the same bar.
+PRICE_TOLERANCE = 0.005
+
+
+class Bars:
+    """Columnar OHLCV for one symbol/table, sorted by UTC datetime.
+
+    Built once per fetched frame; slicing returns views over the same arrays,
+    so chunking for the writer never copies.
+    """
+
+    __slots__ = ("symbol", "times", "open", "high", "low", "close", "volume")
+
+    def __init__(self, symbol, times, open, high, low, close, volume):
+        self.symbol = symbol
+        self.times = times
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    @classmethod
+    def from_frame(cls, symbol, df):
+        times = (
+            pd.DatetimeIndex(pd.to_datetime(df["time"]))
+            .tz_localize(MARKET_TZ)
+            .tz_convert("UTC")
+            .tz_localize(None)
+            .values.astype("datetime64[us]")
+        )
+        volume = df["volume"].to_numpy(dtype=np.float64, na_value=np.nan)
+        bars = cls(
+            symbol,
+            times,
+            df["open"].to_numpy(dtype=np.float64),
+            df["high"].to_numpy(dtype=np.float64),
+            df["low"].to_numpy(dtype=np.float64),
+            df["close"].to_numpy(dtype=np.float64),
+            np.where(np.isnan(volume), 0, volume).astype(np.int64),
+        )
+        if len(times) > 1 and (times[1:] < times[:-1]).any():
+            bars = bars[np.argsort(times, kind="stable")]
+        return bars
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, key):
+        return Bars(
+            self.symbol,
+            self.times[key],
+            self.open[key],
+            self.high[key],
+            self.low[key],
+            self.close[key],
+            self.volume[key],
+        )
+
+    @property
+    def start_time(self):
+        return pd.Timestamp(self.times[0]).to_pydatetime()
+
+    @property
+    def end_time(self):
+        return pd.Timestamp(self.times[-1]).to_pydatetime()
+
+    def dedupe(self):
+        """Keep the last bar for each timestamp (a single upsert statement
+        cannot touch the same row twice)."""
+        if len(self) < 2:
+            return self
+        keep = np.r_[self.times[1:] != self.times[:-1], True]
+        return self if keep.all() else self[keep]
+
+    @classmethod
+    def concat(cls, symbol, parts):
+        fields = ("times", "open", "high", "low", "close", "volume")
+        return cls(
+            symbol,
+            *(
+                np.concatenate([getattr(bars, field) for bars in parts])
+                for field in fields
+            ),
+        )
+
+    def resample(self, unit):
+        """Aggregate into coarser bars bucketed on local market time ("h" for
+        hourly, "D" for daily), stamped like vnstock's own 1H/1D bars."""
+        if not len(self):
+            return self
+        buckets = (self.times + MARKET_UTC_OFFSET).astype(f"datetime64[{unit}]")
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        ends = np.r_[starts[1:], len(buckets)] - 1
+        return Bars(
+            self.symbol,
+            buckets[starts].astype("datetime64[us]") - MARKET_UTC_OFFSET,
+            self.open[starts],
+            np.maximum.reduceat(self.high, starts),
+            np.minimum.reduceat(self.low, starts),
+            self.close[ends],
+            np.add.reduceat(self.volume, starts),
+        )
+
+    def diff(self, source):
+        """Compare these (derived) bars with ``source`` over the derived span."""
+        if len(self):
+            in_span = (source.times >= self.times[0]) & (source.times <= self.times[-1])
+            source = source[in_span]
+        common, mine, theirs = np.intersect1d(
+            self.times, source.times, assume_unique=True, return_indices=True
+        )
+        mismatched = np.zeros(len(common), dtype=bool)
+        for field in ("open", "high", "low", "close"):
+            mismatched |= (
+                np.abs(getattr(self, field)[mine] - getattr(source, field)[theirs])
+                > PRICE_TOLERANCE
+            )
+        mismatched |= self.volume[mine] != source.volume[theirs]
+        return {
+            "compared": len(common),
+            "missing": len(source) - len(common),
+            "extra": len(self) - len(common),
+            "mismatched": int(mismatched.sum()),
+        }
@@ -0,0 +1,812 @@
+"""Benchmarks for crawl.py.
+
+python bench_crawl.py prepare --rows 200000
+python bench_crawl.py fetch --symbols 50 --max-rate 10
+python bench_crawl.py run --symbols 20 --days 30 --output run.json
+python bench_crawl.py run --symbols 20 --days 60 --load-mode batch --static-writes
+python bench_crawl.py queue --symbols 40 --workers 1,2,4
+python bench_crawl.py replay --symbols 20 --days 30 --latency 0.05
+python bench_crawl.py read --symbols 20 --days 60
+python bench_crawl.py compact --symbols 10 --days 250
+
+``run`` drives StockDataProcessor end to end against FakeVnstock and a
+throwaway database (created from migration.ts on the server in DB_CONFIG and
+dropped afterwards), and reports per-stage timings as JSON. ``queue`` does the
+same through the crawl_jobs table with 1..N worker processes, and ``replay``
+loads fresh databases from a raw cache filled by a first crawl. ``read``
+compares reader.py with row-by-row SELECTs over a crawled database, and
+``compact`` measures query planning before and after partition compaction.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import ExitStack, contextmanager
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from bars import MARKET_TZ, Bars
+from crawl import (
+    CHUNK_SIZE,
+    LOAD_MODE,
+    LOAD_MODES,
+    MAX_WORKERS,
+    WRITER_WORKERS,
+    StockDataProcessor,
+)
+from dbpool import DB_CONFIG
+from fetcher import FetchEngine
+from jobqueue import JobQueue
+from reader import COLUMNS, BarReader
+
+MIGRATION_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "migration.ts"
+)
+
+# HOSE continuous sessions plus the 14:45 closing auction, as minute offsets.
+SESSION_MINUTES = np.concatenate(
+    [
+        np.arange(9 * 60 + 15, 11 * 60 + 30),
+        np.arange(13 * 60, 14 * 60 + 30),
+        [14 * 60 + 45],
+    ]
+)
+SESSION_HOURS = np.array([9, 10, 11, 13, 14])
+
+
+def _ohlcv(times, rng):
+    rows = len(times)
+    close = np.round(20 + np.cumsum(rng.normal(0, 0.05, rows)).clip(-15), 2)
+    spread = np.abs(rng.normal(0, 0.05, rows))
+    open_ = np.round(close + rng.normal(0, 0.03, rows), 2)
+    volume = rng.integers(0, 50_000, rows).astype(float)
+    volume[rng.random(rows) < 0.001] = np.nan
+    return pd.DataFrame(
+        {
+            "time": times,
+            "open": open_,
+            "high": np.round(np.maximum(open_, close) + spread, 2),
+            "low": np.round(np.minimum(open_, close) - spread, 2),
+            "close": close,
+            "volume": volume,
+        }
+    )
+
+
+def synthetic_frame(rows, start="2020-01-02 09:15", freq="min", seed=0):
+    """OHLCV frame shaped like vnstock's quote.history() output."""
+    rng = np.random.default_rng(seed)
+    return _ohlcv(pd.date_range(start, periods=rows, freq=freq), rng)
+
+
+def _hash_uniform(keys, salt):
+    """Deterministic uniform [0, 1) noise per integer key (splitmix64)."""
+    x = keys.astype(np.uint64) + np.uint64(salt)
+    x = x * np.uint64(0x9E3779B97F4A7C15)
+    x ^= x >> np.uint64(30)
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x = x * np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return (x >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+def session_minutes(symbol, start, end):
+    """1m bars for ``symbol`` on every weekday in [start, end] on the HOSE
+    session grid (local market time). Each bar depends only on the symbol and
+    its timestamp, so overlapping requests agree with each other."""
+    days = pd.bdate_range(start, end).values.astype("datetime64[m]")
+    offsets = SESSION_MINUTES.astype("timedelta64[m]")
+    times = (days[:, None] + offsets[None, :]).ravel()
+    minutes = times.astype(np.int64)
+    salt = zlib.crc32(symbol.encode())
+    base = 10 + salt % 90
+    close = np.round(
+        base * (1 + 0.2 * np.sin(minutes / 20_000 + salt))
+        + (_hash_uniform(minutes, salt) - 0.5) * 0.2,
+        2,
+    )
+    open_ = np.round(close + (_hash_uniform(minutes, salt + 1) - 0.5) * 0.1, 2)
+    spread = np.round(_hash_uniform(minutes, salt + 2) * 0.1, 2)
+    return pd.DataFrame(
+        {
+            "time": pd.DatetimeIndex(times),
+            "open": open_,
+            "high": np.maximum(open_, close) + spread,
+            "low": np.minimum(open_, close) - spread,
+            "close": close,
+            "volume": (_hash_uniform(minutes, salt + 3) * 50_000).astype(np.int64),
+        }
+    )
+
+
+def session_frame(symbol, start, end, interval):
+    """Bars shaped like quote.history(); 1H/1D are aggregated from the 1m
+    bars the way the upstream builds them, so they are mutually consistent."""
+    minutes = session_minutes(symbol, start, end)
+    if interval == "1m":
+        return minutes
+    bucket = minutes["time"].dt.floor("h" if interval == "1H" else "D")
+    return (
+        minutes.groupby(bucket)
+        .agg(
+            open=("open", "first"),
+            high=("high", "max"),
+            low=("low", "min"),
+            close=("close", "last"),
+            volume=("volume", "sum"),
+        )
+        .rename_axis("time")
+        .reset_index()
+    )
+
+
+class FakeVnstock:
+    """Local stand-in for ``vnstock.Vnstock`` with optional latency and a
+    per-source rate limit that fails requests over ``max_rate`` per second,
+    the way VCI/TCBS throttle us."""
+
+    def __init__(
+        self, latency=0.0, max_rate=None, listing_year=2015, history_start=None
+    ):
+        self.latency = latency
+        self.max_rate = max_rate
+        self.listing_year = listing_year
+        # Oldest bar served, like the upstream's limited intraday history.
+        self.history_start = history_start
+        self.lock = threading.Lock()
+        self.requests = collections.defaultdict(collections.deque)
+        self.calls = 0
+        self.throttled = 0
+
+    def _request(self, source):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+            if self.max_rate is None:
+                return
+            now = time.monotonic()
+            window = self.requests[source]
+            while window and now - window[0] > 1.0:
+                window.popleft()
+            if len(window) >= self.max_rate:
+                self.throttled += 1
+                raise RuntimeError(f"429 Too Many Requests from {source}")
+            window.append(now)
+
+    def stock(self, symbol, source):
+        return _FakeStock(self, symbol, source)
+
+
+class _FakeStock:
+    def __init__(self, client, symbol, source):
+        self.quote = _FakeQuote(client, symbol, source)
+        self.company = _FakeCompany(client, symbol, source)
+
+
+class _FakeQuote:
+    def __init__(self, client, symbol, source):
+        self.client = client
+        self.symbol = symbol
+        self.source = source
+
+    def history(self, start, end, interval):
+        self.client._request(self.source)
+        if self.client.history_start is not None:
+            start = max(pd.Timestamp(start), pd.Timestamp(self.client.history_start))
+        return session_frame(self.symbol, start, end, interval)
+
+
+class _FakeCompany:
+    def __init__(self, client, symbol, source):
+        self.client = client
+        self.source = source
+
+    def overview(self):
+        self.client._request(self.source)
+        return pd.DataFrame({"established_year": [self.client.listing_year]})
+
+
+def legacy_prepare(symbol, df, chunk_size=CHUNK_SIZE):
+    """The per-chunk copy/tz_convert/sort/iterrows path _save_chunk used to run."""
+    rows = 0
+    for i in range(0, len(df), chunk_size):
+        df_chunk = df.iloc[i : i + chunk_size].copy()
+        df_chunk["datetime"] = (
+            pd.to_datetime(df_chunk["time"])
+            .dt.tz_localize(MARKET_TZ)
+            .dt.tz_convert("UTC")
+            .dt.tz_localize(None)
+        )
+        df_chunk = df_chunk.sort_values("datetime")
+        data = [
+            (
+                symbol,
+                row["datetime"],
+                float(row["open"]),
+                float(row["high"]),
+                float(row["low"]),
+                float(row["close"]),
+                int(row["volume"]) if pd.notna(row["volume"]) else 0,
+            )
+            for _, row in df_chunk.iterrows()
+        ]
+        rows += len(data)
+    return rows
+
+
+def payload_prepare(build):
+    """Time one of StockDataProcessor's chunk payload builders over a frame."""
+
+    def prepare(symbol, df, chunk_size=CHUNK_SIZE):
+        bars = Bars.from_frame(symbol, df)
+        for i in range(0, len(bars), chunk_size):
+            build(bars[i : i + chunk_size])
+        return len(bars)
+
+    return prepare
+
+
+def bench_prepare(rows, chunk_size=CHUNK_SIZE):
+    """Per-million-row cost of the legacy row tuples and of the payload each
+    load mode builds for a chunk."""
+    df = synthetic_frame(rows)
+    results = {"rows": rows, "chunk_size": chunk_size}
+    for name, prepare in [
+        ("legacy", legacy_prepare),
+        ("copy", payload_prepare(StockDataProcessor._copy_text_payload)),
+        ("copy_binary", payload_prepare(StockDataProcessor._copy_binary_payload)),
+        (
+            "batch",
+            payload_prepare(lambda bars: StockDataProcessor._array_params([bars])),
+        ),
+    ]:
+        started = time.perf_counter()
+        prepared = prepare("BENCH", df, chunk_size)
+        elapsed = time.perf_counter() - started
+        assert prepared == rows
+        results[f"{name}_seconds_per_million"] = elapsed * 1_000_000 / rows
+    return results
+
+
+def bench_fetch(symbols, max_rate, rate, concurrency, latency, days=5):
+    """Drive FetchEngine against a throttling FakeVnstock."""
+    client = FakeVnstock(latency=latency, max_rate=max_rate)
+    limits = {
+        "VCI": {"rate": rate, "burst": max(1, int(rate)), "concurrency": concurrency}
+    }
+    engine = FetchEngine(client, limits=limits, backoff=0.2)
+    end = pd.Timestamp("2024-06-28")
+    start = (end - pd.tseries.offsets.BDay(days)).strftime("%Y-%m-%d")
+
+    async def run():
+        results = await asyncio.gather(
+            *(
+                engine.history(f"S{i:03d}", start, end.strftime("%Y-%m-%d"), "1m")
+                for i in range(symbols)
+            ),
+            return_exceptions=True,
+        )
+        return sum(not isinstance(result, Exception) for result in results)
+
+    started = time.perf_counter()
+    succeeded = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+    engine.close()
+    return {
+        "symbols": symbols,
+        "succeeded": succeeded,
+        "seconds": elapsed,
+        "requests_per_sec": client.calls / elapsed,
+        "upstream_calls": client.calls,
+        "throttled": client.throttled,
+        **engine.stats,
+    }
+
+
+def migration_statements(path=MIGRATION_FILE):
+    """The SQL run by the up() half of the TypeORM migration."""
+    with open(path, "r") as f:
+        source = f.read()
+    up = source[source.index("async up(") : source.index("async down(")]
+    return re.findall(r"`(.*?)`", up, re.S)
+
+
+@contextmanager
+def throwaway_database(db_config=DB_CONFIG):
+    """Create a scratch database with the stock schema; drop it on exit."""
+    name = f"crawl_bench_{os.getpid()}_{int(time.time())}"
+    admin = psycopg2.connect(**dict(db_config, dbname="postgres"))
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute(f'CREATE DATABASE "{name}"')
+        config = dict(db_config, dbname=name)
+        with psycopg2.connect(**config) as conn:
+            with conn.cursor() as cur:
+                for statement in migration_statements():
+                    cur.execute(statement)
+        conn.close()
+        yield config
+    finally:
+        with admin.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+        admin.close()
+
+
+# The fake never throttles; let the engine run flat out.
+UNLIMITED = {"rate": 1000.0, "burst": 1000, "concurrency": 16}
+
+
+def fake_symbols(count):
+    return [f"B{i:03d}" for i in range(count)]
+
+
+def history_start(days):
+    """First day of a fake history ``days`` business days long."""
+    return pd.Timestamp.now().normalize() - pd.tseries.offsets.BDay(days)
+
+
+@contextmanager
+def fake_crawler(days, latency=0.0, db_config=None, log_dir=None, **options):
+    """A StockDataProcessor over FakeVnstock tickers with ``days`` of history,
+    writing to a throwaway database and log directory unless given; its
+    fetcher and pool are closed on exit."""
+    start = history_start(days)
+    with ExitStack() as stack:
+        if db_config is None:
+            db_config = stack.enter_context(throwaway_database())
+        if log_dir is None:
+            log_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        processor = StockDataProcessor(
+            client=FakeVnstock(
+                latency=latency, listing_year=start.year, history_start=start
+            ),
+            source_limits={"VCI": UNLIMITED, "TCBS": UNLIMITED},
+            db_config=db_config,
+            log_dir=log_dir,
+            **options,
+        )
+        try:
+            yield processor
+        finally:
+            processor.fetcher.close()
+            processor.pool.closeall()
+
+
+def bench_run(
+    symbols,
+    days,
+    load_mode=LOAD_MODE,
+    fetch_workers=MAX_WORKERS,
+    writer_workers=WRITER_WORKERS,
+    derive=None,
+    latency=0.0,
+    cache_dir=None,
+    replay=False,
+    static_writes=False,
+):
+    """One full crawl of ``symbols`` fake tickers with ``days`` of history."""
+    with fake_crawler(
+        days,
+        latency,
+        load_mode=load_mode,
+        fetch_workers=fetch_workers,
+        writer_workers=writer_workers,
+        adaptive_writes=not static_writes,
+        derive=derive,
+        cache_dir=cache_dir,
+        replay=replay,
+    ) as processor:
+        started = time.perf_counter()
+        processor.process_symbols(fake_symbols(symbols))
+        wall = time.perf_counter() - started
+
+    rows = {table: stats["processed"] for table, stats in processor.stats.items()}
+    return {
+        "config": {
+            "symbols": symbols,
+            "days": days,
+            "load_mode": load_mode,
+            "fetch_workers": fetch_workers,
+            "writer_workers": writer_workers,
+            "derive": derive,
+            "latency": latency,
+            "cache": bool(cache_dir),
+            "replay": replay,
+            "static_writes": static_writes,
+        },
+        "wall_seconds": wall,
+        "rows": rows,
+        "rows_per_sec": sum(rows.values()) / wall if wall else 0.0,
+        "failed": {table: stats["failed"] for table, stats in processor.stats.items()},
+        "stages": processor.timings.snapshot(),
+        "sql": processor._sql_summary(),
+        "pipeline": processor.pipeline_status(),
+        "upstream": dict(processor.fetcher.stats),
+        "cache": dict(processor.cache.stats) if processor.cache else None,
+        "tuning": processor.tuner.status(),
+        "pool": dict(processor.pool.stats),
+    }
+
+
+def bench_replay(symbols, days, load_mode=LOAD_MODE, latency=0.0):
+    """Crawl into a fresh database three times over one raw cache: cold
+    (filling it), warm (upstream only for today) and replay-only."""
+    runs = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for mode in ("cold", "warm", "replay"):
+            result = bench_run(
+                symbols,
+                days,
+                load_mode=load_mode,
+                latency=latency,
+                cache_dir=cache_dir,
+                replay=mode == "replay",
+            )
+            runs[mode] = {
+                key: result[key]
+                for key in ("wall_seconds", "rows", "rows_per_sec", "cache")
+            }
+            runs[mode]["upstream_calls"] = result["upstream"]["calls"]
+    return {
+        "config": {
+            "symbols": symbols,
+            "days": days,
+            "load_mode": load_mode,
+            "latency": latency,
+        },
+        "runs": runs,
+    }
+
+
+def _queue_worker(db_config, log_dir, worker_id, days, latency, verbose):
+    if not verbose:
+        logging.disable(logging.WARNING)
+    with fake_crawler(
+        days, latency, db_config=db_config, log_dir=log_dir, worker_id=worker_id
+    ) as processor:
+        processor.work_queue(JobQueue(db_config, worker_id))
+
+
+def bench_queue(symbols, days, worker_counts, latency=0.0, verbose=False):
+    """Crawl the same fake universe through the job queue with each number
+    of worker processes; reports wall time and speedup over the first."""
+    names = fake_symbols(symbols)
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for workers in worker_counts:
+        with throwaway_database() as db_config, tempfile.TemporaryDirectory() as log_dir:
+            jobs = JobQueue(db_config, "bench")
+            jobs.create()
+            jobs.enqueue(names)
+            processes = [
+                context.Process(
+                    target=_queue_worker,
+                    args=(
+                        db_config,
+                        log_dir,
+                        f"bench{i}",
+                        days,
+                        latency,
+                        verbose,
+                    ),
+                )
+                for i in range(workers)
+            ]
+            started = time.perf_counter()
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            wall = time.perf_counter() - started
+
+            with psycopg2.connect(**db_config) as conn, conn.cursor() as cur:
+                rows = {}
+                for table in ("stock1m", "stock1h", "stock1d"):
+                    cur.execute(f"SELECT count(*) FROM {table}")
+                    rows[table] = cur.fetchone()[0]
+            conn.close()
+            counts = jobs.counts()
+            jobs.close()
+
+        total = sum(rows.values())
+        results.append(
+            {
+                "workers": workers,
+                "wall_seconds": wall,
+                "rows": rows,
+                "rows_per_sec": total / wall if wall else 0.0,
+                "jobs": counts,
+                "speedup": (
+                    results[0]["wall_seconds"] / wall if results and wall else 1.0
+                ),
+            }
+        )
+    return {
+        "config": {"symbols": symbols, "days": days, "latency": latency},
+        "runs": results,
+    }
+
+
+def bench_read(symbols, days):
+    """Read every crawled 1m bar back: a row-by-row SELECT into a DataFrame,
+    then BarReader cold, warm, and for a sub-range of the cached one."""
+    names = fake_symbols(symbols)
+    start = history_start(days)
+    end = pd.Timestamp.now().normalize() + pd.Timedelta(days=1)
+    timings = {}
+
+    with fake_crawler(days) as processor:
+        processor.process_symbols(names)
+        db_config = processor.db_config
+
+        with psycopg2.connect(**db_config) as conn, conn.cursor() as cur:
+            started = time.perf_counter()
+            cur.execute(
+                f"""
+                SELECT {", ".join(COLUMNS)} FROM stock1m
+                WHERE ticker = ANY(%s) AND datetime >= %s AND datetime < %s
+                ORDER BY ticker, datetime
+                """,
+                (names, start.to_pydatetime(), end.to_pydatetime()),
+            )
+            rowwise = pd.DataFrame(cur.fetchall(), columns=list(COLUMNS)).astype(
+                {column: float for column in ("open", "high", "low", "close")}
+            )
+            timings["rowwise"] = time.perf_counter() - started
+        conn.close()
+
+        reader = BarReader(db_config)
+        try:
+            for label, (lo, hi) in (
+                ("reader_cold", (start, end)),
+                ("reader_warm", (start, end)),
+                ("reader_subrange", (start + pd.Timedelta(days=7), end)),
+            ):
+                started = time.perf_counter()
+                frame = reader.frame(names, "1m", lo, hi)
+                timings[label] = time.perf_counter() - started
+                if label == "reader_cold":
+                    assert len(frame) == len(rowwise)
+                    assert np.allclose(frame["close"], rowwise["close"])
+            stats = dict(reader.stats)
+        finally:
+            reader.close()
+
+    rows = len(rowwise)
+    return {
+        "config": {"symbols": symbols, "days": days},
+        "rows": rows,
+        "seconds": timings,
+        "rows_per_sec": {
+            label: rows / seconds if seconds else 0.0
+            for label, seconds in timings.items()
+        },
+        "reader": stats,
+    }
+
+
+# Planned and run before and after compaction: the watermark snapshot,
+# _get_last_datetime's fallback, and one ticker's month as reader.py reads it.
+COMPACT_QUERIES = {
+    "watermarks": "SELECT ticker, MAX(datetime) FROM stock1m GROUP BY ticker",
+    "last_datetime": "SELECT MAX(datetime) FROM stock1m WHERE ticker = 'B000'",
+    "month": """
+        SELECT * FROM stock1m
+        WHERE ticker = 'B000' AND datetime >= %(start)s AND datetime < %(end)s
+    """,
+}
+
+
+def _query_times(db_config, params, repeat=20):
+    """Planning and execution milliseconds of each COMPACT_QUERIES entry:
+    planning on a fresh connection (cold relation cache), then medians over
+    ``repeat`` more runs."""
+    results = {}
+    for label, query in COMPACT_QUERIES.items():
+        conn = psycopg2.connect(**db_config)
+        try:
+            with conn.cursor() as cur:
+                runs = []
+                for _ in range(repeat + 1):
+                    cur.execute(
+                        f"EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) {query}", params
+                    )
+                    plan = cur.fetchone()[0][0]
+                    runs.append((plan["Planning Time"], plan["Execution Time"]))
+        finally:
+            conn.close()
+        planning, execution = np.median(runs[1:], axis=0)
+        results[label] = {
+            "cold_planning_ms": runs[0][0],
+            "planning_ms": float(planning),
+            "execution_ms": float(execution),
+        }
+    return results
+
+
+def _partition_count(cur):
+    cur.execute(
+        "SELECT count(*) FROM pg_inherits WHERE inhparent = 'stock1m'::regclass"
+    )
+    return cur.fetchone()[0]
+
+
+def bench_compact(symbols, days, unit="M"):
+    """Crawl ``days`` of daily 1m partitions, time planning and execution of
+    COMPACT_QUERIES, compact every closed period and time them again. Then
+    delete days inside a merged partition and repair them, to check writes
+    still land there without new daily partitions."""
+    names = fake_symbols(symbols)
+    month = history_start(days) + pd.offsets.MonthBegin(1)
+    params = {
+        "start": month.to_pydatetime(),
+        "end": (month + pd.offsets.MonthBegin(1)).to_pydatetime(),
+    }
+    checksum = "SELECT count(*), sum(volume), sum(close) FROM stock1m"
+    result = {"config": {"symbols": symbols, "days": days, "unit": unit}}
+
+    with fake_crawler(days) as processor:
+        db_config = processor.db_config
+        admin = psycopg2.connect(**db_config)
+        admin.autocommit = True
+        try:
+            processor.process_symbols(names)
+            with admin.cursor() as cur:
+                cur.execute("VACUUM ANALYZE stock1m")
+                result["partitions_before"] = _partition_count(cur)
+                cur.execute(checksum)
+                before = cur.fetchone()
+            result["before"] = _query_times(db_config, params)
+
+            started = time.perf_counter()
+            merged = processor.compact_partitions(
+                unit=unit, before=pd.Timestamp.now().normalize()
+            )
+            result["compact_seconds"] = time.perf_counter() - started
+            result["merged"] = merged
+            with admin.cursor() as cur:
+                result["partitions_after"] = _partition_count(cur)
+                cur.execute(checksum)
+                assert cur.fetchone() == before, "compaction changed the data"
+            result["after"] = _query_times(db_config, params)
+
+            with admin.cursor() as cur:
+                cur.execute(
+                    """
+                    DELETE FROM stock1m WHERE ticker = 'B000'
+                    AND datetime >= %(start)s
+                    AND datetime < %(start)s + interval '4 days'
+                    """,
+                    params,
+                )
+                result["deleted"] = cur.rowcount
+            processor.repair_gaps(names)
+            with admin.cursor() as cur:
+                cur.execute(checksum)
+                result["repaired"] = cur.fetchone() == before
+                result["partitions_after_repair"] = _partition_count(cur)
+            result["recompacted"] = processor.compact_partitions(
+                unit=unit, before=pd.Timestamp.now().normalize()
+            )
+        finally:
+            admin.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="crawl.py benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    prepare = sub.add_parser("prepare", help="row preparation cost per million rows")
+    prepare.add_argument("--rows", type=int, default=200_000)
+    prepare.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    fetch = sub.add_parser("fetch", help="fetch engine against a throttled fake")
+    fetch.add_argument("--symbols", type=int, default=50)
+    fetch.add_argument("--max-rate", type=float, default=10, help="fake's limit")
+    fetch.add_argument("--rate", type=float, default=9, help="engine's limit")
+    fetch.add_argument("--concurrency", type=int, default=8)
+    fetch.add_argument("--latency", type=float, default=0.05)
+
+    run = sub.add_parser("run", help="end-to-end crawl against a scratch database")
+    run.add_argument("--symbols", type=int, default=10)
+    run.add_argument("--days", type=int, default=20, help="business days of history")
+    run.add_argument("--load-mode", choices=LOAD_MODES, default=LOAD_MODE)
+    run.add_argument("--fetch-workers", type=int, default=MAX_WORKERS)
+    run.add_argument("--writer-workers", type=int, default=WRITER_WORKERS)
+    run.add_argument("--derive", choices=("write", "verify"))
+    run.add_argument("--latency", type=float, default=0.0)
+    run.add_argument("--static-writes", action="store_true")
+    run.add_argument("--output", help="write the JSON result here")
+    run.add_argument("--verbose", action="store_true")
+
+    jobs = sub.add_parser("queue", help="job-queue crawl with N worker processes")
+    jobs.add_argument("--symbols", type=int, default=40)
+    jobs.add_argument("--days", type=int, default=20, help="business days of history")
+    jobs.add_argument(
+        "--workers",
+        type=lambda value: [int(n) for n in value.split(",")],
+        default=[1, 2, 4],
+        help="comma-separated worker process counts",
+    )
+    jobs.add_argument("--latency", type=float, default=0.0)
+    jobs.add_argument("--verbose", action="store_true")
+
+    replay = sub.add_parser("replay", help="cold, warm and replay-only raw cache runs")
+    replay.add_argument("--symbols", type=int, default=10)
+    replay.add_argument("--days", type=int, default=20, help="business days of history")
+    replay.add_argument("--load-mode", choices=LOAD_MODES, default=LOAD_MODE)
+    replay.add_argument("--latency", type=float, default=0.05)
+    replay.add_argument("--verbose", action="store_true")
+
+    read = sub.add_parser("read", help="bulk reads against row-by-row SELECTs")
+    read.add_argument("--symbols", type=int, default=20)
+    read.add_argument("--days", type=int, default=60, help="business days of history")
+
+    compact = sub.add_parser("compact", help="query planning before/after compaction")
+    compact.add_argument("--symbols", type=int, default=10)
+    compact.add_argument(
+        "--days", type=int, default=250, help="business days of history"
+    )
+    compact.add_argument("--unit", choices=("M", "Y"), default="M")
+
+    args = parser.parse_args()
+    if args.command == "prepare":
+        print(json.dumps(bench_prepare(args.rows, args.chunk_size), indent=2))
+    elif args.command == "fetch":
+        result = bench_fetch(
+            args.symbols, args.max_rate, args.rate, args.concurrency, args.latency
+        )
+        print(json.dumps(result, indent=2))
+    elif args.command == "run":
+        if not args.verbose:
+            logging.disable(logging.WARNING)
+        result = bench_run(
+            args.symbols,
+            args.days,
+            load_mode=args.load_mode,
+            fetch_workers=args.fetch_workers,
+            writer_workers=args.writer_workers,
+            derive=args.derive,
+            latency=args.latency,
+            static_writes=args.static_writes,
+        )
+        output = json.dumps(result, indent=2)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(output + "\n")
+        print(output)
+    elif args.command == "queue":
+        result = bench_queue(
+            args.symbols, args.days, args.workers, args.latency, args.verbose
+        )
+        print(json.dumps(result, indent=2))
+    elif args.command == "replay":
+        if not args.verbose:
+            logging.disable(logging.WARNING)
+        result = bench_replay(args.symbols, args.days, args.load_mode, args.latency)
+        print(json.dumps(result, indent=2))
+    elif args.command == "read":
+        logging.disable(logging.WARNING)
+        print(json.dumps(bench_read(args.symbols, args.days), indent=2))
+    elif args.command == "compact":
+        logging.disable(logging.WARNING)
+        print(json.dumps(bench_compact(args.symbols, args.days, args.unit), indent=2))
+
+
+if __name__ == "__main__":
+    main()
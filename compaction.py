@@ -0,0 +1,167 @@
+"""Merging of closed range partitions into one per month or year.
+
+Each period is rebuilt in its own transaction, under the advisory lock that
+partition creation takes: writes to its partitions are blocked (reads are
+not) while their rows are copied, sorted by (ticker, datetime), into a new
+table carrying a CHECK constraint on its bounds. The parent's constraints and
+indexes are then built on the sorted rows and the table analyzed, so ATTACH
+neither scans it nor builds anything; the old partitions are detached and
+dropped in the same transaction.
+"""
+
+import re
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+# Periods are merged once they ended COMPACT_MIN_AGE ago, so late repairs
+# still land in small partitions. The copy sorts and builds indexes with
+# COMPACT_WORK_MEM, and gives up rather than wait longer than
+# COMPACT_LOCK_TIMEOUT behind writers for any lock.
+COMPACT_UNITS = ("M", "Y")
+COMPACT_MIN_AGE = timedelta(days=7)
+COMPACT_WORK_MEM = "256MB"
+COMPACT_LOCK_TIMEOUT = "30s"
+
+
+class PartitionCompactor:
+    """Merges a table's closed partitions into one per month or year."""
+
+    NAME_FORMATS = {"M": "%Y_%m", "Y": "%Y"}
+    _INDEX_RE = re.compile(r"^CREATE (UNIQUE )?INDEX \S+ ON (?:ONLY )?\S+ (USING .*)$")
+
+    def __init__(self, registry, timer=None):
+        self.registry = registry
+        self.timer = timer
+
+    def plan(self, cur, table_name, unit, before):
+        """{period: [partition names]} of the periods ending by ``before``
+        that are not yet one partition (or inside a coarser one)."""
+        periods = {}
+        for _, partition_name, start, end in self.registry.bounds(cur, [table_name]):
+            period = start.astype(f"datetime64[{unit}]")
+            if end > (period + 1).astype(end.dtype):
+                continue
+            periods.setdefault(period, []).append((partition_name, start, end))
+        cutoff = np.datetime64(before, "us")
+        plan = {}
+        for period, partitions in sorted(periods.items()):
+            period_start = period.astype("datetime64[us]")
+            period_end = (period + 1).astype("datetime64[us]")
+            if period_end > cutoff:
+                continue
+            if len(partitions) == 1:
+                _, start, end = partitions[0]
+                if start == period_start and end == period_end:
+                    continue
+            plan[period] = sorted(name for name, _, _ in partitions)
+        return plan
+
+    def _index_statements(self, cur, table_name, target):
+        """The parent's unique constraints and indexes, for ``target``."""
+        cur.execute(
+            """
+            SELECT pg_get_indexdef(i.indexrelid), pg_get_constraintdef(c.oid)
+            FROM pg_index i
+            LEFT JOIN pg_constraint c ON c.conindid = i.indexrelid
+            WHERE i.indrelid = %s::regclass
+            """,
+            (table_name,),
+        )
+        statements = []
+        for indexdef, constraintdef in cur.fetchall():
+            if constraintdef is not None:
+                statements.append(f"ALTER TABLE {target} ADD {constraintdef}")
+                continue
+            match = self._INDEX_RE.match(indexdef)
+            if match is None:
+                raise ValueError(f"Cannot rebuild index: {indexdef}")
+            statements.append(
+                f"CREATE {match.group(1) or ''}INDEX ON {target} {match.group(2)}"
+            )
+        return statements
+
+    def _timed(self, cur, table_name, statement, sql, params=None):
+        started = time.perf_counter()
+        cur.execute(sql, params)
+        if self.timer is not None:
+            self.timer.observe(
+                time.perf_counter() - started, table=table_name, statement=statement
+            )
+
+    def compact(self, conn, table_name, unit, period):
+        """Merge ``period``'s partitions into one; returns (partitions
+        merged, rows moved), or None if there is nothing left to merge."""
+        start = period.astype("datetime64[us]")
+        end = (period + 1).astype("datetime64[us]")
+        start_date = pd.Timestamp(start).to_pydatetime()
+        end_date = pd.Timestamp(end).to_pydatetime()
+        target = f"{table_name}_{start_date.strftime(self.NAME_FORMATS[unit])}"
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"SET LOCAL lock_timeout = '{COMPACT_LOCK_TIMEOUT}'")
+                cur.execute(f"SET LOCAL maintenance_work_mem = '{COMPACT_WORK_MEM}'")
+                cur.execute(f"SET LOCAL work_mem = '{COMPACT_WORK_MEM}'")
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (table_name,))
+                sources = self.plan(cur, table_name, unit, end).get(period)
+                if not sources:
+                    conn.rollback()
+                    return None
+                self._timed(
+                    cur,
+                    table_name,
+                    "compact_lock",
+                    f"LOCK TABLE {', '.join(sources)} IN SHARE MODE",
+                )
+                cur.execute(
+                    f"""
+                    CREATE TABLE {target} (
+                        LIKE {table_name} INCLUDING DEFAULTS,
+                        CONSTRAINT {target}_bounds
+                        CHECK (datetime >= %s AND datetime < %s)
+                    )
+                    """,
+                    (start_date, end_date),
+                )
+                self._timed(
+                    cur,
+                    table_name,
+                    "compact_copy",
+                    f"""
+                    INSERT INTO {target}
+                    SELECT * FROM {table_name}
+                    WHERE datetime >= %s AND datetime < %s
+                    ORDER BY ticker, datetime
+                    """,
+                    (start_date, end_date),
+                )
+                rows = cur.rowcount
+                for statement in self._index_statements(cur, table_name, target):
+                    self._timed(cur, table_name, "compact_index", statement)
+                self._timed(cur, table_name, "compact_analyze", f"ANALYZE {target}")
+
+                swap_started = time.perf_counter()
+                for source in sources:
+                    cur.execute(f"ALTER TABLE {table_name} DETACH PARTITION {source}")
+                cur.execute(
+                    f"""
+                    ALTER TABLE {table_name} ATTACH PARTITION {target}
+                    FOR VALUES FROM (%s) TO (%s)
+                    """,
+                    (start_date, end_date),
+                )
+                cur.execute(f"ALTER TABLE {target} DROP CONSTRAINT {target}_bounds")
+                cur.execute(f"DROP TABLE {', '.join(sources)}")
+                if self.timer is not None:
+                    self.timer.observe(
+                        time.perf_counter() - swap_started,
+                        table=table_name,
+                        statement="compact_swap",
+                    )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return len(sources), rows
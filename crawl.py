@@ -1,46 +1,176 @@
+import argparse
+import asyncio
+import io
+import atexit
 import logging
-from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import queue
 import psycopg2
-from psycopg2 import pool
-from psycopg2.extras import execute_batch
 from vnstock import *
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import json
 from const import VN30, VN100
+from fetcher import FetchEngine, parse_source_limit
+from bars import MARKET_UTC_OFFSET, Bars
+from compaction import COMPACT_MIN_AGE, COMPACT_UNITS, PartitionCompactor
+from dbpool import DB_CONFIG, ConnectionPool
+from jobqueue import JobQueue
+from journal import ProgressJournal
+from metrics import Metrics, SymbolProfiler
+from rawcache import CACHE_MAX_BYTES, RawCache
+from tradingcalendar import GAP_MIN_FILL, MARKET_HOLIDAYS, TradingCalendar, gap_windows
 import signal
-import pickle
+import fcntl
+import socket
+from contextlib import contextmanager, nullcontext
 import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import time
 from dateutil.relativedelta import relativedelta
 from datetime import timedelta
 
-main_logger = logging.getLogger()
-main_logger.setLevel(logging.INFO)
+# Every logger feeds one queue; a single listener thread does the console and
+# file I/O, so hot paths never block on a disk write and the number of open
+# handlers doesn't grow with the symbol universe.
+LOG_FILE = "crawl.jsonl"
+LOG_FILE_MAX_BYTES = 64 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
 
-os.makedirs("logs", exist_ok=True)
 
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per record, with the symbol/table a record was
+    logged for as fields of their own."""
+
+    FIELDS = ("symbol", "table")
 
-formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-console_handler.setFormatter(formatter)
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry)
+
+
+_log_queue = queue.Queue()
+_log_listener = None
+
+
+def configure_logging(log_dir=None, log_file=LOG_FILE):
+    """Route the root logger through the log queue to the console and, if
+    ``log_dir`` is given, a size-capped JSON-lines file there."""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(
+        logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    )
+    handlers = [console_handler]
+    if log_dir is not None:
+        file_handler = RotatingFileHandler(
+            os.path.join(log_dir, log_file),
+            maxBytes=LOG_FILE_MAX_BYTES,
+            backupCount=LOG_FILE_BACKUPS,
+        )
+        file_handler.setLevel(logging.INFO)
+        file_handler.setFormatter(JsonLinesFormatter())
+        handlers.append(file_handler)
 
-main_logger.addHandler(console_handler)
+    root = logging.getLogger()
+    if not any(isinstance(handler, QueueHandler) for handler in root.handlers):
+        root.addHandler(QueueHandler(_log_queue))
+    _log_listener = QueueListener(_log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    return _log_listener
 
-DB_CONFIG = {
-    "dbname": "stockgpt-trading",
-    "user": "admin",
-    "password": "dev",
-    # "user": "onstocks",
-    # "password": ".wHD0_Q]Xf')aq(b",
-    "host": "localhost",
-}
 
+def _stop_logging():
+    if _log_listener is not None:
+        _log_listener.stop()
+
+
+main_logger = logging.getLogger()
+main_logger.setLevel(logging.INFO)
+
+os.makedirs("logs", exist_ok=True)
+configure_logging()
+atexit.register(_stop_logging)
+
+# Rows per write transaction and concurrent writers are starting points:
+# WriteTuner adjusts both from the commits of each TUNE_WINDOW transactions,
+# keeping a transaction under COMMIT_LATENCY_TARGET seconds and taking a
+# bigger chunk or another writer only while it gains TUNE_MIN_GAIN throughput.
 CHUNK_SIZE = 1000
+CHUNK_SIZE_MIN = 250
+CHUNK_SIZE_MAX = 50000
+COMMIT_LATENCY_TARGET = 1.0
+TUNE_WINDOW = 20
+TUNE_MIN_GAIN = 0.05
+# Windows before a knob whose last change didn't pay off is tried again.
+TUNE_RETRY_WINDOWS = 10
+# Symbols fetched concurrently; request rates are capped per source by
+# fetcher.SOURCE_LIMITS.
 MAX_WORKERS = 4
-MIN_CONNECTIONS = 1
-MAX_CONNECTIONS = 20
+WRITER_WORKERS = 2
+MAX_WRITER_WORKERS = 8
+# Fetched frames waiting for a writer; fetchers block once it is full.
+WRITE_QUEUE_SIZE = 8
+PIPELINE_REPORT_INTERVAL = 30
+# Partitions created per transaction; each takes a handful of relation locks
+# and max_locks_per_transaction is 64 by default.
+PARTITION_BATCH_SIZE = 200
+# Dedicated connections used to VACUUM the partitions a run wrote to, and how
+# often the concurrent maintainer looks for partitions that are finished.
+MAINTENANCE_WORKERS = 4
+MAINTENANCE_INTERVAL = 60
+MAINTENANCE_MODES = ("after", "concurrent", "off")
+# Pooled connections beyond one per fetcher and writer, for the watermark,
+# partition and maintenance passes.
+POOL_SPARE_CONNECTIONS = 1
+
+# "copy" / "copy_binary" stream each chunk into a temp staging table with
+# COPY FROM STDIN and merge it with one upsert; "batch" passes each chunk's
+# columns as array parameters instead, and is also the fallback when a bulk
+# load fails. Both upserts are prepared once per pooled connection. Binary
+# COPY is the default: its payload is packed straight from the Bars arrays,
+# where the text payload and the array literals format every value as a string
+# (see ``bench_crawl.py prepare``).
+LOAD_MODE = "copy_binary"
+LOAD_MODES = ("copy", "copy_binary", "batch")
+# Column type of the stored prices (see migration.ts); incoming prices are
+# compared at this precision so re-fetched bars that round to the stored
+# values are left untouched.
+PRICE_TYPE = "numeric(10,2)"
+
+_PG_EPOCH = np.datetime64("2000-01-01T00:00:00", "us")
+_COPY_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + b"\x00" * 8
+_COPY_BINARY_TRAILER = b"\xff\xff"
+# Parameters of the "arrays" upsert: the update's time bounds, then columns.
+_UPSERT_ARRAY_TYPES = (
+    "timestamp",
+    "timestamp",
+    "varchar[]",
+    "timestamp[]",
+    "float8[]",
+    "float8[]",
+    "float8[]",
+    "float8[]",
+    "bigint[]",
+)
 
 _INTERVAL_MAP = {
     "1m": "1m",
@@ -48,24 +178,764 @@ _INTERVAL_MAP = {
     "1d": "1D",
 }
 
+# Tables that can be derived from stock1m, with the local-time bucket unit.
+DERIVED_TABLES = {"stock1h": "h", "stock1d": "D"}
+TABLE_UNITS = {"stock1m": "m", **DERIVED_TABLES}
+DERIVE_MODES = ("write", "verify")
 
-class StockDataProcessor:
+DEFAULT_LISTING_DATE = datetime(2000, 1, 1)
+
+# Long histories are fetched and written one window at a time so memory stays
+# bounded and a failure only costs the window that failed. None = one request.
+BACKFILL_WINDOWS = {
+    "stock1m": pd.Timedelta(weeks=1),
+    "stock1h": pd.Timedelta(days=365),
+    "stock1d": None,
+}
+# How far back the upstream keeps bars of each table; a backfill starts no
+# earlier, rather than walking week-long 1m windows back to a listing date
+# in 2000 that would almost all come back empty.
+HISTORY_HORIZONS = {
+    "stock1m": pd.Timedelta(days=365),
+    "stock1h": None,
+    "stock1d": None,
+}
+LISTING_CACHE_TTL = timedelta(days=30)
+
+QUEUE_MODES = ("enqueue", "work")
+
+# Live mode polls once per bar, this long after each minute closes (the
+# upstream needs a moment to publish it), and keeps polling this long past
+# a session's end for late bars.
+LIVE_POLL_INTERVAL = 60
+LIVE_POLL_DELAY = 2.0
+LIVE_SESSION_GRACE = timedelta(minutes=2)
+
+
+class PartitionRegistry:
+    """In-memory map of which days/months already have a range partition;
+    missing ones are created under an advisory lock."""
+
+    UNITS = {"stock1m": "D", "stock1h": "M", "stock1d": "M"}
+    NAME_FORMATS = {"D": "%Y_%m_%d", "M": "%Y_%m"}
+    _BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.covered = {table_name: set() for table_name in self.UNITS}
+        # period -> name of the partition holding it
+        self.names = {table_name: {} for table_name in self.UNITS}
+
+    def periods(self, table_name, times):
+        unit = self.UNITS[table_name]
+        return np.unique(times.astype(f"datetime64[{unit}]")).tolist()
+
+    def missing(self, table_name, periods):
+        covered = self.covered[table_name]
+        return [period for period in periods if period not in covered]
+
+    def partition_names(self, table_name, periods):
+        names = self.names[table_name]
+        return sorted({names[period] for period in periods if period in names})
+
+    def bounds(self, cur, table_names=None):
+        """(table, partition, start, end) for every range partition of
+        ``table_names`` (default all), read from the catalog."""
+        cur.execute(
+            """
+            SELECT
+                parent.relname,
+                child.relname,
+                pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits i
+            JOIN pg_class parent ON parent.oid = i.inhparent
+            JOIN pg_class child ON child.oid = i.inhrelid
+            WHERE parent.relname = ANY(%s)
+            """,
+            (list(table_names or self.UNITS),),
+        )
+        partitions = []
+        for table_name, partition_name, bound in cur.fetchall():
+            match = self._BOUND_RE.search(bound or "")
+            if match:
+                partitions.append(
+                    (
+                        table_name,
+                        partition_name,
+                        np.datetime64(match.group(1)),
+                        np.datetime64(match.group(2)),
+                    )
+                )
+        return partitions
+
+    def _read_catalog(self, cur):
+        covered = {table_name: set() for table_name in self.UNITS}
+        names = {table_name: {} for table_name in self.UNITS}
+        for table_name, partition_name, start, end in self.bounds(cur):
+            # A merged partition (see PartitionCompactor) covers many periods.
+            unit = self.UNITS[table_name]
+            periods = np.arange(
+                start.astype(f"datetime64[{unit}]"), end.astype(f"datetime64[{unit}]")
+            ).tolist()
+            covered[table_name].update(periods)
+            names[table_name].update(dict.fromkeys(periods, partition_name))
+        self.covered = covered
+        self.names = names
+
+    def load(self, conn):
+        with self.lock:
+            with conn.cursor() as cur:
+                self._read_catalog(cur)
+            conn.commit()
+
+    def ensure(self, conn, table_name, times):
+        """Make sure every bar in ``times`` has a partition; returns how many
+        partitions were created."""
+        periods = self.periods(table_name, times)
+        if not self.missing(table_name, periods):
+            return 0
+
+        unit = self.UNITS[table_name]
+        name_format = self.NAME_FORMATS[unit]
+        created = 0
+        with self.lock:
+            while True:
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            "SELECT pg_advisory_xact_lock(hashtext(%s))",
+                            (table_name,),
+                        )
+                        # Another worker may have created some while we waited.
+                        self._read_catalog(cur)
+                        batch = self.missing(table_name, periods)
+                        batch = batch[:PARTITION_BATCH_SIZE]
+                        for period in batch:
+                            start = np.datetime64(period, unit)
+                            start_date = pd.Timestamp(start).to_pydatetime()
+                            end_date = pd.Timestamp(start + 1).to_pydatetime()
+                            partition_name = (
+                                f"{table_name}_{start_date.strftime(name_format)}"
+                            )
+                            cur.execute(
+                                f"""
+                                CREATE TABLE IF NOT EXISTS {partition_name}
+                                PARTITION OF {table_name}
+                                FOR VALUES FROM (%s) TO (%s);
+                                """,
+                                (start_date, end_date),
+                            )
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                self.covered[table_name].update(batch)
+                for period in batch:
+                    self.names[table_name][period] = (
+                        f"{table_name}_"
+                        f"{pd.Timestamp(np.datetime64(period, unit)).strftime(name_format)}"
+                    )
+                created += len(batch)
+                if len(batch) < PARTITION_BATCH_SIZE:
+                    return created
+
+    def prepare(self, conn, table_name, start, end):
+        """Pre-create partitions for [start, end] before any inserts run."""
+        unit = self.UNITS[table_name]
+        times = np.arange(np.datetime64(start, unit), np.datetime64(end, unit) + 1)
+        if unit == "D":
+            times = times[np.is_busday(times)]
+        if len(times) == 0:
+            return 0
+        return self.ensure(conn, table_name, times)
+
+
+class PartitionMaintenance:
+    """Partitions written to this run, vacuumed and analyzed on their own
+    autocommit connections (VACUUM cannot run in a transaction)."""
+
+    def __init__(self, db_config, registry, workers=MAINTENANCE_WORKERS, timer=None):
+        self.db_config = db_config
+        self.registry = registry
+        self.workers = workers
+        self.timer = timer
+        self.lock = threading.Lock()
+        self.touched = {table_name: set() for table_name in registry.UNITS}
+
+    def touch(self, table_name, times):
+        periods = self.registry.periods(table_name, times)
+        with self.lock:
+            self.touched[table_name].update(periods)
+
+    def pending(self, finished_before=None):
+        """Touched partitions per table, limited to periods that end by
+        ``finished_before[table_name]`` when given."""
+        with self.lock:
+            touched = {
+                table_name: set(periods) for table_name, periods in self.touched.items()
+            }
+        pending = {}
+        for table_name, periods in touched.items():
+            if finished_before is not None:
+                cutoff = finished_before.get(table_name)
+                if cutoff is None:
+                    continue
+                unit = self.registry.UNITS[table_name]
+                cutoff = np.datetime64(cutoff, "us")
+                periods = {
+                    period
+                    for period in periods
+                    if np.datetime64(period, unit) + 1 <= cutoff
+                }
+            if periods:
+                pending[table_name] = periods
+        return pending
+
+    def _vacuum(self, jobs):
+        logger = logging.getLogger()
+        conn = psycopg2.connect(**self.db_config)
+        conn.autocommit = True
+        vacuumed = 0
+        try:
+            with conn.cursor() as cur:
+                for table_name, partition_name in jobs:
+                    started = time.perf_counter()
+                    try:
+                        cur.execute(f"VACUUM (ANALYZE) {partition_name};")
+                        vacuumed += 1
+                    except Exception as e:
+                        logger.error(
+                            f"Maintenance error for {partition_name}: {str(e)}"
+                        )
+                        continue
+                    elapsed = time.perf_counter() - started
+                    if self.timer is not None:
+                        self.timer.observe(
+                            elapsed, table=table_name, statement="vacuum"
+                        )
+                    logger.info(
+                        f"Completed maintenance for {partition_name} in {elapsed:.2f}s"
+                    )
+        finally:
+            conn.close()
+        return vacuumed
+
+    def run(self, conn, finished_before=None):
+        """VACUUM (ANALYZE) pending partitions in parallel; returns how many
+        were vacuumed. ``conn`` is only used to refresh partition names."""
+        pending = self.pending(finished_before)
+        if not pending:
+            return 0
+        self.registry.load(conn)
+
+        jobs = [
+            (table_name, partition_name)
+            for table_name, periods in pending.items()
+            for partition_name in self.registry.partition_names(table_name, periods)
+        ]
+        # Claim the periods now; writes that land during the vacuum re-add them.
+        with self.lock:
+            for table_name, periods in pending.items():
+                self.touched[table_name].difference_update(periods)
+
+        workers = max(1, min(self.workers, len(jobs)))
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="maintenance"
+        ) as executor:
+            return sum(
+                executor.map(self._vacuum, (jobs[i::workers] for i in range(workers)))
+            )
+
+
+class Watermarks:
+    """Latest stored bar per (ticker, table), loaded once and advanced in
+    memory as chunks commit."""
+
+    TABLES = ("stock1m", "stock1h", "stock1d")
 
     def __init__(self):
-        self.vnstock = Vnstock()
-        self.pool = self._create_connection_pool()
-        self.log_dir = "logs"
-        self.progress_file = os.path.join(self.log_dir, "progress.json")
-        self.checkpoint_file = os.path.join(self.log_dir, "checkpoint.pkl")
-        self.stats = {
-            "stock1m": {"processed": 0, "failed": 0},
-            "stock1h": {"processed": 0, "failed": 0},
-            "stock1d": {"processed": 0, "failed": 0},
+        self.lock = threading.Lock()
+        self.marks = {}
+        self.loaded = False
+
+    def load(self, conn, symbols=None):
+        marks = {}
+        with conn.cursor() as cur:
+            for table_name in self.TABLES:
+                if symbols is None:
+                    cur.execute(
+                        f"SELECT ticker, MAX(datetime) FROM {table_name} GROUP BY ticker"
+                    )
+                else:
+                    cur.execute(
+                        f"""
+                        SELECT ticker, MAX(datetime) FROM {table_name}
+                        WHERE ticker = ANY(%s)
+                        GROUP BY ticker
+                        """,
+                        (list(symbols),),
+                    )
+                for ticker, last_date in cur.fetchall():
+                    marks[(ticker, table_name)] = pd.Timestamp(last_date)
+        conn.commit()
+        with self.lock:
+            self.marks = marks
+            self.loaded = True
+
+    def get(self, symbol, table_name):
+        return self.marks.get((symbol, table_name))
+
+    def advance(self, symbol, table_name, last_date):
+        last_date = pd.Timestamp(last_date)
+        with self.lock:
+            current = self.marks.get((symbol, table_name))
+            if current is None or last_date > current:
+                self.marks[(symbol, table_name)] = last_date
+
+
+class ListingCache:
+    """Listing dates from the TCBS company overview, persisted as JSON and
+    refetched after ``ttl``."""
+
+    def __init__(self, path, ttl=LISTING_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = {}
+        cutoff = datetime.now() - self.ttl
+        with self.lock:
+            self.entries = {
+                symbol: entry
+                for symbol, entry in entries.items()
+                if datetime.fromisoformat(entry["fetched_at"]) >= cutoff
+            }
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with self.lock:
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+
+    def get(self, symbol):
+        entry = self.entries.get(symbol)
+        if entry is None:
+            return None
+        return datetime.fromisoformat(entry["listing_date"])
+
+    def put(self, symbol, listing_date):
+        with self.lock:
+            self.entries[symbol] = {
+                "listing_date": listing_date.date().isoformat(),
+                "fetched_at": datetime.now().isoformat(timespec="seconds"),
+            }
+
+
+class PipelineStage:
+    """Busy time and throughput for one stage of the fetch/write pipeline;
+    with ``slots`` (a WriteTuner), only its active writers count."""
+
+    def __init__(self, name, workers, slots=None):
+        self.name = name
+        self.workers = workers
+        self.slots = slots
+        self.lock = threading.Lock()
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.started = time.perf_counter()
+        self.slots_started = slots.slot_seconds() if slots else 0.0
+
+    def record(self, seconds):
+        with self.lock:
+            self.items += 1
+            self.busy_seconds += seconds
+
+    def status(self):
+        if self.slots is None:
+            workers = self.workers
+            capacity = (time.perf_counter() - self.started) * workers
+        else:
+            workers = self.slots.status()["writers"]
+            capacity = self.slots.slot_seconds() - self.slots_started
+        return {
+            "workers": workers,
+            "items": self.items,
+            "utilisation": self.busy_seconds / capacity if capacity else 0.0,
         }
+
+
+class WriteTuner:
+    """Rows per write transaction and number of active writers, adjusted
+    after every ``window`` commits from their latency and throughput."""
+
+    def __init__(
+        self,
+        chunk_size=CHUNK_SIZE,
+        writers=WRITER_WORKERS,
+        max_writers=MAX_WRITER_WORKERS,
+        backlog=lambda: 0,
+        adaptive=True,
+        target=COMMIT_LATENCY_TARGET,
+        window=TUNE_WINDOW,
+        min_gain=TUNE_MIN_GAIN,
+    ):
+        self.chunk_size = chunk_size
+        self.active = min(writers, max_writers)
+        self.max_writers = max_writers
+        self.backlog = backlog
+        self.adaptive = adaptive
+        self.target = target
+        self.window = window
+        self.min_gain = min_gain
+        self.cond = threading.Condition()
+        self.busy = 0
+        # (knob, value before the change, throughput before the change)
+        self.trial = None
+        self.resting = {}
+        self.windows = 0
+        # Writer-seconds the active slots have been open, up to slots_since.
+        self.slots_open = 0.0
+        self.slots_since = time.perf_counter()
+        self._reset_window()
+
+    def _reset_window(self):
+        self.commits = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def slot(self):
+        """Held by a writer while it takes and writes a frame; at most
+        ``active`` writers hold one at a time."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.busy < self.active)
+            self.busy += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.busy -= 1
+                self.cond.notify_all()
+
+    def record(self, rows, seconds):
+        """Account one committed write transaction."""
+        if not self.adaptive:
+            return
+        with self.cond:
+            self.commits += 1
+            self.rows += rows
+            self.seconds += seconds
+            if self.commits < self.window:
+                return
+            wall = time.perf_counter() - self.started
+            throughput = self.rows / wall if wall else 0.0
+            latency = self.seconds / self.commits
+            before = (self.chunk_size, self.active)
+            self._count_slots()
+            self._tune(throughput, latency)
+            self._reset_window()
+            if (self.chunk_size, self.active) != before:
+                self.cond.notify_all()
+                logging.getLogger().info(
+                    f"Write tuning: {self.chunk_size} rows per chunk, "
+                    f"{self.active} writers (was {before[0]} and {before[1]}; "
+                    f"{throughput:.0f} rows/s, {latency:.2f}s per commit)"
+                )
+
+    def _count_slots(self):
+        # Caller holds self.cond.
+        now = time.perf_counter()
+        self.slots_open += (now - self.slots_since) * self.active
+        self.slots_since = now
+
+    def slot_seconds(self):
+        """Writer-seconds of active slots so far, following every change in
+        the number of writers."""
+        with self.cond:
+            self._count_slots()
+            return self.slots_open
+
+    def _tune(self, throughput, latency):
+        # Caller holds self.cond. Over the latency target, shrink the chunk
+        # (then drop a writer); otherwise try one change per window and
+        # revert it unless throughput gains min_gain.
+        self.windows += 1
+        if latency > self.target:
+            if self.chunk_size > CHUNK_SIZE_MIN:
+                self.chunk_size = max(CHUNK_SIZE_MIN, self.chunk_size // 2)
+                self.resting["chunk"] = self.windows
+            elif self.active > 1:
+                self.active -= 1
+                self.resting["writers"] = self.windows
+            self.trial = None
+            return
+
+        if self.trial is not None:
+            knob, previous, baseline = self.trial
+            self.trial = None
+            if throughput < baseline * (1 + self.min_gain):
+                if knob == "chunk":
+                    self.chunk_size = previous
+                else:
+                    self.active = previous
+                self.resting[knob] = self.windows
+            return
+
+        def ready(knob):
+            rested = self.resting.get(knob)
+            return rested is None or self.windows - rested >= TUNE_RETRY_WINDOWS
+
+        if (
+            ready("chunk")
+            and self.chunk_size < CHUNK_SIZE_MAX
+            and latency * 2 <= self.target
+        ):
+            self.trial = ("chunk", self.chunk_size, throughput)
+            self.chunk_size = min(CHUNK_SIZE_MAX, self.chunk_size * 2)
+        elif ready("writers") and self.active < self.max_writers and self.backlog():
+            self.trial = ("writers", self.active, throughput)
+            self.active += 1
+
+    def status(self):
+        with self.cond:
+            return {"chunk_size": self.chunk_size, "writers": self.active}
+
+
+class StageTimings:
+    """Wall time, calls and rows per processing stage since this object was
+    created, read from the process-wide stage histogram."""
+
+    STAGES = ("fetch", "transform", "partition", "insert", "checkpoint")
+
+    def __init__(self, metrics):
+        self.seconds = metrics.histogram(
+            "crawl_stage_seconds", "Seconds per call of each processing stage"
+        )
+        self.rows = metrics.counter(
+            "crawl_stage_rows_total", "Rows handled by each processing stage"
+        )
+        self.baseline = self._totals()
+
+    def _totals(self):
+        totals = {}
+        for stage in self.STAGES:
+            summary = self.seconds.summary(stage=stage)
+            totals[stage] = {
+                "calls": summary["count"],
+                "seconds": summary["sum"],
+                "rows": self.rows.value(stage=stage),
+            }
+        return totals
+
+    def add(self, stage, seconds, rows=0):
+        self.seconds.observe(seconds, stage=stage)
+        if rows:
+            self.rows.inc(rows, stage=stage)
+
+    @contextmanager
+    def time(self, stage, rows=0):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started, rows)
+
+    def snapshot(self):
+        stages = {}
+        for stage, current in self._totals().items():
+            totals = {
+                key: value - self.baseline[stage][key] for key, value in current.items()
+            }
+            totals["rows_per_sec"] = (
+                totals["rows"] / totals["seconds"] if totals["seconds"] else 0.0
+            )
+            stages[stage] = totals
+        return stages
+
+
+class TableStats:
+    """Rows processed, failed, inserted, updated and unchanged, and load
+    time, per table since this object was created."""
+
+    TABLES = ("stock1m", "stock1h", "stock1d")
+
+    def __init__(self, metrics):
+        self.counters = {
+            "processed": metrics.counter(
+                "crawl_rows_processed_total", "Rows written per table"
+            ),
+            "inserted": metrics.counter(
+                "crawl_rows_inserted_total", "New rows inserted per table"
+            ),
+            "updated": metrics.counter(
+                "crawl_rows_updated_total", "Existing rows overwritten per table"
+            ),
+            "unchanged": metrics.counter(
+                "crawl_rows_unchanged_total",
+                "Rows already stored with the same values, skipped",
+            ),
+            "failed": metrics.counter(
+                "crawl_rows_failed_total", "Rows that could not be written per table"
+            ),
+            "load_seconds": metrics.counter(
+                "crawl_load_seconds_total", "Seconds spent loading frames per table"
+            ),
+        }
+        self.baseline = self._totals()
+
+    def _totals(self):
+        return {
+            table_name: {
+                key: counter.value(table=table_name)
+                for key, counter in self.counters.items()
+            }
+            for table_name in self.TABLES
+        }
+
+    def add(self, table_name, key, value):
+        self.counters[key].inc(value, table=table_name)
+
+    def snapshot(self):
+        return {
+            table_name: {
+                key: value - self.baseline[table_name][key]
+                for key, value in totals.items()
+            }
+            for table_name, totals in self._totals().items()
+        }
+
+
+class StockDataProcessor:
+
+    def __init__(
+        self,
+        load_mode=LOAD_MODE,
+        fetch_workers=MAX_WORKERS,
+        writer_workers=WRITER_WORKERS,
+        max_writer_workers=MAX_WRITER_WORKERS,
+        adaptive_writes=True,
+        queue_size=WRITE_QUEUE_SIZE,
+        client=None,
+        source_limits=None,
+        backfill_windows=None,
+        derive=None,
+        db_config=None,
+        log_dir="logs",
+        metrics_file=None,
+        profile_symbol=None,
+        maintenance="after",
+        maintenance_workers=MAINTENANCE_WORKERS,
+        worker_id=None,
+        cache_dir=None,
+        cache_max_bytes=CACHE_MAX_BYTES,
+        replay=False,
+    ):
+        if load_mode not in LOAD_MODES:
+            raise ValueError(f"Unknown load mode: {load_mode}")
+        if derive is not None and derive not in DERIVE_MODES:
+            raise ValueError(f"Unknown derive mode: {derive}")
+        if maintenance not in MAINTENANCE_MODES:
+            raise ValueError(f"Unknown maintenance mode: {maintenance}")
+        if replay and cache_dir is None:
+            raise ValueError("Replay needs a raw cache directory")
+        self.vnstock = client if client is not None else Vnstock()
+        self.fetcher = FetchEngine(self.vnstock, limits=source_limits)
+        self.cache = RawCache(cache_dir, cache_max_bytes) if cache_dir else None
+        self.replay = replay
+        self.db_config = db_config if db_config is not None else DB_CONFIG
+        self.fetch_workers = fetch_workers
+        self.writer_workers = (
+            max(writer_workers, max_writer_workers)
+            if adaptive_writes
+            else writer_workers
+        )
+        self.pool = self._create_connection_pool(writer_workers)
+        self.partitions = PartitionRegistry()
+        self.watermarks = Watermarks()
+        self.load_mode = load_mode
+        self.tuner = WriteTuner(
+            writers=writer_workers,
+            max_writers=self.writer_workers,
+            backlog=lambda: self.pipeline_status().get("queue_depth", 0),
+            adaptive=adaptive_writes,
+        )
+        self.queue_size = queue_size
+        self.backfill_windows = dict(BACKFILL_WINDOWS, **(backfill_windows or {}))
+        self.derive = derive
+        self.derive_report = self._empty_derive_report()
+        self.pipeline = {}
+        self.metrics = Metrics()
+        self.metrics_file = metrics_file
+        self.timings = StageTimings(self.metrics)
+        self.table_stats = TableStats(self.metrics)
+        self.sql_seconds = self.metrics.histogram(
+            "crawl_sql_seconds", "Seconds per SQL statement on the write path"
+        )
+        self.pool_wait = self.metrics.histogram(
+            "crawl_pool_wait_seconds", "Seconds spent acquiring a database connection"
+        )
+        self.live_latency = self.metrics.histogram(
+            "crawl_live_bar_latency_seconds",
+            "Seconds from a 1m bar closing to its row committing in live mode",
+        )
+        self.live_commits = {}
+        self.sql_baseline = {}
+        self.maintenance_mode = maintenance
+        self.maintenance = PartitionMaintenance(
+            self.db_config,
+            self.partitions,
+            workers=maintenance_workers,
+            timer=self.sql_seconds,
+        )
+        self._register_gauges()
+        self.log_dir = log_dir
+        self.profiler = (
+            SymbolProfiler(
+                profile_symbol,
+                os.path.join(log_dir, f"profile_{profile_symbol}.pstats"),
+            )
+            if profile_symbol
+            else None
+        )
+        # Worker processes sharing a log_dir each keep their own journal and
+        # log file.
+        suffix = f"-{worker_id}" if worker_id else ""
+        self.worker_id = worker_id
+        self.worker_lock = None
+        if worker_id:
+            os.makedirs(self.log_dir, exist_ok=True)
+            self.worker_lock = open(
+                os.path.join(self.log_dir, f"worker{suffix}.lock"), "w"
+            )
+            try:
+                fcntl.flock(self.worker_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.worker_lock.close()
+                raise RuntimeError(f"Worker {worker_id} is already running here")
+        self.journal = ProgressJournal(
+            os.path.join(self.log_dir, f"progress{suffix}.journal")
+        )
+        self.resume_marks = {}
+        self.failed_streams = set()
+        self.repairing = False
+        self.listing_dates = ListingCache(
+            os.path.join(self.log_dir, "listing_dates.json")
+        )
+        self.listing_lookups = {}
+        self.stats_lock = threading.Lock()
         self.is_running = True
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
         os.makedirs(self.log_dir, exist_ok=True)
+        configure_logging(self.log_dir, f"crawl{suffix}.jsonl")
 
     def __del__(self):
         if hasattr(self, "pool") and self.pool:
@@ -74,107 +944,228 @@ class StockDataProcessor:
             except Exception:
                 pass
 
-    def _create_connection_pool(self):
-        return psycopg2.pool.SimpleConnectionPool(
-            MIN_CONNECTIONS,
-            MAX_CONNECTIONS,
-            **DB_CONFIG,  # min connections  # max connections
+    def _create_connection_pool(self, writer_workers):
+        """One connection per fetcher (for _get_last_datetime) and writer,
+        plus spares; those the writers start with are opened up front."""
+        return ConnectionPool(
+            self.db_config,
+            self.fetch_workers + self.writer_workers + POOL_SPARE_CONNECTIONS,
+            prewarm=writer_workers + POOL_SPARE_CONNECTIONS,
         )
 
-    def _setup_logger(self, symbol):
-        symbol_log_dir = os.path.join(self.log_dir, symbol)
-        os.makedirs(symbol_log_dir, exist_ok=True)
+    @property
+    def stats(self):
+        return self.table_stats.snapshot()
+
+    def _add_stat(self, table_name, key, value):
+        self.table_stats.add(table_name, key, value)
+
+    def _register_gauges(self):
+        def pipeline_gauge(key):
+            def read():
+                status = self.pipeline_status()
+                return [
+                    ({"stage": stage}, status[stage][key])
+                    for stage in ("fetch", "write")
+                    if stage in status
+                ]
+
+            return read
+
+        self.metrics.gauge(
+            "crawl_queue_depth",
+            "Fetched frames waiting for a writer",
+            lambda: self.pipeline_status().get("queue_depth", 0),
+        )
+        self.metrics.gauge(
+            "crawl_pipeline_items",
+            "Items completed by each pipeline stage this run",
+            pipeline_gauge("items"),
+        )
+        self.metrics.gauge(
+            "crawl_pipeline_utilisation",
+            "Busy fraction of each pipeline stage's workers this run",
+            pipeline_gauge("utilisation"),
+        )
+        self.metrics.gauge(
+            "crawl_pool_connections_in_use",
+            "Connections checked out of the pool",
+            self.pool.in_use,
+        )
+        self.metrics.gauge(
+            "crawl_pool_connections_opened",
+            "Connections opened by the pool, and stale ones it replaced",
+            lambda: [
+                ({"result": key}, value) for key, value in self.pool.stats.items()
+            ],
+        )
+        self.metrics.gauge(
+            "crawl_write_tuning",
+            "Rows per write transaction and active writers, as tuned",
+            lambda: [
+                ({"knob": key}, value) for key, value in self.tuner.status().items()
+            ],
+        )
+        self.metrics.gauge(
+            "crawl_upstream_requests",
+            "Upstream calls, retries and errors",
+            lambda: [
+                ({"result": key}, value) for key, value in self.fetcher.stats.items()
+            ],
+        )
 
-        loggers = {}
-        for interval in ["1m", "1h", "1d"]:
-            logger_name = f"stock_logger_{symbol}_{interval}"
-            logger = logging.getLogger(logger_name)
-            logger.setLevel(logging.INFO)
-            logger.handlers = []
+        if self.cache is not None:
+            self.metrics.gauge(
+                "crawl_raw_cache_files",
+                "Raw cache period lookups and file operations",
+                lambda: [
+                    ({"result": key}, value) for key, value in self.cache.stats.items()
+                ],
+            )
+            self.metrics.gauge(
+                "crawl_raw_cache_bytes",
+                "Size of the raw cache directory",
+                lambda: self.cache.size,
+            )
 
-            log_file = os.path.join(symbol_log_dir, f"{interval}_data_stock.log")
-            file_handler = logging.FileHandler(log_file)
-            file_handler.setLevel(logging.INFO)
+    def _sql_timer(self, table_name, statement):
+        return self.sql_seconds.time(table=table_name, statement=statement)
+
+    def _sql_totals(self):
+        totals = {}
+        for labels, cell in self.sql_seconds.values().items():
+            statement = dict(labels)["statement"]
+            count, seconds = totals.get(statement, (0, 0.0))
+            totals[statement] = (count + sum(cell[:-1]), seconds + cell[-1])
+        return totals
+
+    def _sql_summary(self):
+        """Statements and seconds per SQL statement kind this run."""
+        return {
+            statement: {
+                "count": count - self.sql_baseline.get(statement, (0, 0.0))[0],
+                "sum": seconds - self.sql_baseline.get(statement, (0, 0.0))[1],
+            }
+            for statement, (count, seconds) in self._sql_totals().items()
+        }
 
-            formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-            file_handler.setFormatter(formatter)
+    def _getconn(self):
+        with self.pool_wait.time():
+            return self.pool.getconn()
 
-            logger.addHandler(file_handler)
-            logger.addHandler(logging.StreamHandler())
+    def _profile(self, symbol):
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.profile(symbol)
 
-            loggers[f"stock{interval}"] = logger
+    def _export_metrics(self):
+        if not self.metrics_file:
+            return
+        try:
+            self.metrics.write_textfile(self.metrics_file)
+        except OSError as e:
+            logging.getLogger().error(f"Error writing metrics: {str(e)}")
+
+    def _empty_derive_report(self):
+        return {
+            table_name: {"compared": 0, "missing": 0, "extra": 0, "mismatched": 0}
+            for table_name in DERIVED_TABLES
+        }
 
-        return loggers
+    def _setup_logger(self, symbol):
+        """Per-table loggers for ``symbol``: adapters over one shared logger
+        that tag each record with its symbol and table."""
+        logger = logging.getLogger("stock")
+        return {
+            table_name: logging.LoggerAdapter(
+                logger, {"symbol": symbol, "table": table_name}
+            )
+            for table_name in Watermarks.TABLES
+        }
 
-    def _maintenance(self):
-        tables = ["stock1d", "stock1h", "stock1m"]
+    def _maintenance(self, finished_before=None):
+        """VACUUM (ANALYZE) the partitions written to since the last pass;
+        with ``finished_before``, only those no symbol will write to again."""
         logger = logging.getLogger()
-
-        # Close all existing connections in the pool
-        if hasattr(self, "pool"):
-            self.pool.closeall()
-
+        conn = self._getconn()
         try:
-            # Create dedicated maintenance connection
-            maintenance_conn = psycopg2.connect(**DB_CONFIG)
-            maintenance_conn.autocommit = True
-
-            with maintenance_conn.cursor() as cur:
-                for table in tables:
-                    try:
-                        cur.execute(f"VACUUM (VERBOSE, ANALYZE) {table};")
-                        logger.info(f"Completed maintenance for {table}")
-                    except Exception as e:
-                        logger.error(f"Maintenance error for {table}: {str(e)}")
-
+            vacuumed = self.maintenance.run(conn, finished_before)
+            if vacuumed:
+                logger.info(f"Maintenance vacuumed {vacuumed} partitions")
         except Exception as e:
+            conn.rollback()
             logger.error(f"Error during maintenance: {str(e)}")
-
         finally:
-            if "maintenance_conn" in locals():
-                maintenance_conn.close()
-
-            # Recreate the connection pool
-            self.pool = self._create_connection_pool()
-
-    def _save_progress(self, completed_symbols):
-        with open(self.progress_file, "w") as f:
-            json.dump({"completed": list(completed_symbols)}, f)
+            self.pool.putconn(conn)
 
-    def _load_progress(self):
+    def compact_partitions(self, table_name="stock1m", unit="M", before=None):
+        """Merge closed partitions into one per ``unit`` ("M" or "Y");
+        returns how many partitions were merged away."""
+        logger = logging.getLogger()
+        if unit not in COMPACT_UNITS:
+            raise ValueError(f"Unknown compaction unit: {unit}")
+        if before is None:
+            before = pd.Timestamp.now().normalize() - COMPACT_MIN_AGE
+        compactor = PartitionCompactor(self.partitions, timer=self.sql_seconds)
+        conn = self._getconn()
+        merged = 0
         try:
-            with open(self.progress_file, "r") as f:
-                return set(json.load(f)["completed"])
-        except:
-            return set()
+            with conn.cursor() as cur:
+                plan = compactor.plan(cur, table_name, unit, before)
+            conn.commit()
+            logger.info(
+                f"Compacting {sum(len(names) for names in plan.values())} "
+                f"partitions of {table_name} into {len(plan)}"
+            )
+            for period in plan:
+                if not self.is_running:
+                    break
+                started = time.perf_counter()
+                try:
+                    result = compactor.compact(conn, table_name, unit, period)
+                except psycopg2.Error as e:
+                    # Typically a lock timeout behind writers; the next run
+                    # picks the period up again.
+                    logger.error(f"Error compacting {table_name} {period}: {str(e)}")
+                    continue
+                if result is None:
+                    continue
+                sources, rows = result
+                merged += sources - 1
+                logger.info(
+                    f"Compacted {sources} partitions of {table_name} for {period} "
+                    f"({rows} rows) in {time.perf_counter() - started:.2f}s"
+                )
+            self.partitions.load(conn)
+        finally:
+            self.pool.putconn(conn)
+        return merged
+
+    def _finished_before(self, unsettled):
+        """Per table, the time before which no unsettled symbol will write:
+        each resumes from its watermark, so the oldest one bounds them all."""
+        cutoffs = {}
+        for table_name in self.partitions.UNITS:
+            marks = [self.watermarks.get(symbol, table_name) for symbol in unsettled]
+            if None in marks:
+                continue
+            cutoffs[table_name] = min(marks) if marks else pd.Timestamp.max
+        return cutoffs
 
     def _signal_handler(self, signum, frame):
         main_logger = logging.getLogger()
         main_logger.info("Received interrupt signal. Gracefully shutting down...")
         self.is_running = False
 
-    def _save_checkpoint(self, symbol, table_name, chunk_info):
-        checkpoint = {
-            "symbol": symbol,
-            "table_name": table_name,
-            "chunk_info": chunk_info,
-            "timestamp": datetime.now(),
-        }
-        with open(self.checkpoint_file, "wb") as f:
-            pickle.dump(checkpoint, f)
-
-    def _load_checkpoint(self):
-        try:
-            if os.path.exists(self.checkpoint_file):
-                with open(self.checkpoint_file, "rb") as f:
-                    return pickle.load(f)
-        except Exception as e:
-            logging.error(f"Error loading checkpoint: {str(e)}")
-        return None
+    def _mark_committed(self, symbol, table_name, end_time):
+        if self.repairing:
+            return
+        with self.timings.time("checkpoint"):
+            self.journal.mark(symbol, table_name, end_time)
 
     def _get_last_datetime(self, symbol, table_name):
+        conn = self._getconn()
         try:
-            conn = self.pool.getconn()
             with conn.cursor() as cur:
                 cur.execute(
                     f"""
@@ -194,385 +1185,1566 @@ class StockDataProcessor:
         finally:
             self.pool.putconn(conn)
 
-    def _get_listing_date(self, symbol):
+    async def _fetch_listing_date(self, symbol):
         try:
-            stock_info = self.vnstock.stock(symbol=symbol, source="TCBS")
-            company_info = stock_info.company.overview()
+            company_info = await self.fetcher.overview(symbol)
             if not company_info.empty and "established_year" in company_info.columns:
                 established_year = company_info["established_year"].iloc[0]
                 if pd.notna(established_year):
-                    start_date = datetime(int(established_year), 1, 1)
-                    return start_date
+                    return datetime(int(established_year), 1, 1)
 
-            return datetime(2000, 1, 1)
+            logging.getLogger().warning(f"No established_year for {symbol}")
+            return None
 
         except Exception as e:
-            return datetime(2000, 1, 1)
+            logging.getLogger().warning(
+                f"Error fetching listing date for {symbol}: {str(e)}"
+            )
+            return None
 
-    def _process_symbol(self, symbol):
-        loggers = self._setup_logger(symbol)
-        try:
-            listing_date = self._get_listing_date(symbol)
-            listing_date = pd.Timestamp(listing_date).tz_localize(None)
-            stock = self.vnstock.stock(symbol=symbol, source="VCI")
+    async def _get_listing_date(self, symbol):
+        listing_date = self.listing_dates.get(symbol)
+        if listing_date is None:
+            # Share one lookup between the background refresh and the fetch.
+            lookup = self.listing_lookups.get(symbol)
+            if lookup is None:
+                lookup = asyncio.ensure_future(self._fetch_listing_date(symbol))
+                self.listing_lookups[symbol] = lookup
+            listing_date = await lookup
+            if listing_date is None:
+                return DEFAULT_LISTING_DATE
+            self.listing_dates.put(symbol, listing_date)
+        return listing_date
+
+    async def _refresh_listing_dates(self, symbols):
+        """Fetch listing dates in the background for symbols that will need
+        one (no watermark in some table) and aren't cached yet."""
+        if self.replay:
+            return
+        pending = [
+            symbol
+            for symbol in symbols
+            if self.listing_dates.get(symbol) is None
+            and any(
+                self.watermarks.get(symbol, table_name) is None
+                for table_name in Watermarks.TABLES
+            )
+        ]
+        for symbol in pending:
+            if not self.is_running:
+                break
+            await self._get_listing_date(symbol)
+        if pending:
+            self.listing_dates.save()
+
+    async def _fetch_windows(self, symbol, interval, table_name, start_date, end_date):
+        """Yield Bars for [start_date, end_date] one backfill window at a
+        time, stopping at the first window that fails."""
+        window = self.backfill_windows.get(table_name)
+        if window is None or end_date - start_date <= window:
+            edges = [start_date, end_date]
+        else:
+            edges = list(pd.date_range(start_date, end_date, freq=window))
+            if edges[-1] < end_date:
+                edges.append(end_date)
+
+        for i, (window_start, window_end) in enumerate(zip(edges, edges[1:])):
+            if not self.is_running:
+                return
+            # vnstock's start/end are inclusive dates; don't refetch the
+            # boundary day of the previous window.
+            if i > 0:
+                window_start = window_start + pd.Timedelta(days=1)
+                if window_start > window_end:
+                    continue
+            started = time.perf_counter()
+            df = await self._history(symbol, interval, window_start, window_end)
+            rows = 0 if df is None else len(df)
+            self.timings.add("fetch", time.perf_counter() - started, rows)
+            if rows:
+                with self.timings.time("transform", rows):
+                    bars = Bars.from_frame(symbol, df)
+                yield bars
+
+    async def _history(self, symbol, interval, start, end):
+        """quote.history for the days [start, end], from the raw cache where
+        it has them."""
+        if self.cache is None:
+            return await self.fetcher.history(
+                symbol,
+                start=start.strftime("%Y-%m-%d"),
+                end=end.strftime("%Y-%m-%d"),
+                interval=_INTERVAL_MAP[interval],
+            )
+        start = start.normalize()
+        end = end.normalize()
+        cached, missing = await asyncio.to_thread(
+            self.cache.read, symbol, interval, start, end
+        )
+        frames = [] if cached is None else [cached]
+        if not self.replay:
+            # Today's bars are still coming in; only earlier periods are kept.
+            closed_before = TradingCalendar.now().normalize()
+            for gap_start, gap_end in missing:
+                df = await self.fetcher.history(
+                    symbol,
+                    start=gap_start.strftime("%Y-%m-%d"),
+                    end=gap_end.strftime("%Y-%m-%d"),
+                    interval=_INTERVAL_MAP[interval],
+                )
+                await asyncio.to_thread(
+                    self.cache.write,
+                    symbol,
+                    interval,
+                    df,
+                    gap_start,
+                    gap_end,
+                    closed_before,
+                )
+                if df is not None and len(df):
+                    frames.append(df)
+        if not frames:
+            return None
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
 
+    async def _incremental_spans(self, symbol):
+        """Per table, the day range still to fetch for ``symbol``: from its
+        last stored bar (or its listing date) up to now."""
+        if self.watermarks.loaded:
+            last_dates = {
+                table_name: self.watermarks.get(symbol, table_name)
+                for table_name in Watermarks.TABLES
+            }
+        else:
             last_dates = {
-                "stock1m": self._get_last_datetime(symbol, "stock1m"),
-                "stock1h": self._get_last_datetime(symbol, "stock1h"),
-                "stock1d": self._get_last_datetime(symbol, "stock1d"),
+                table_name: await asyncio.to_thread(
+                    self._get_last_datetime, symbol, table_name
+                )
+                for table_name in Watermarks.TABLES
             }
 
-            for table_name in last_dates:
-                if last_dates[table_name] is not None:
-                    if last_dates[table_name].tzinfo is not None:
-                        last_dates[table_name] = pd.Timestamp(
-                            last_dates[table_name]
-                        ).tz_localize(None)
-
-            current_time = pd.Timestamp.now().tz_localize(None)
-            data = {}
-
-            for interval, table_name in [
-                ("1m", "stock1m"),
-                ("1h", "stock1h"),
-                ("1d", "stock1d"),
-            ]:
-                if last_dates[table_name]:
-                    start_date = last_dates[table_name]
-                else:
-                    start_date = listing_date
+        for table_name in last_dates:
+            if last_dates[table_name] is not None:
+                if last_dates[table_name].tzinfo is not None:
+                    last_dates[table_name] = pd.Timestamp(
+                        last_dates[table_name]
+                    ).tz_localize(None)
+
+        listing_date = None
+        if any(last_date is None for last_date in last_dates.values()):
+            if self.replay:
+                earliest = await asyncio.to_thread(self.cache.earliest, symbol)
+                listing_date = pd.Timestamp(earliest or DEFAULT_LISTING_DATE)
+            else:
+                listing_date = pd.Timestamp(await self._get_listing_date(symbol))
+
+        current_time = pd.Timestamp.now().tz_localize(None)
+        start_dates = {
+            table_name: last_dates[table_name] or listing_date
+            for table_name in last_dates
+        }
+        end_dates = dict.fromkeys(start_dates, current_time)
+        if self.derive == "write":
+            # 1h/1d come from the 1m bars, so 1m has to cover their gaps too.
+            start_dates["stock1m"] = min(start_dates.values())
+        for table_name, horizon in HISTORY_HORIZONS.items():
+            if horizon is not None:
+                start_dates[table_name] = max(
+                    start_dates[table_name], (current_time - horizon).normalize()
+                )
+        if self.derive == "write":
+            # Only what is older than the 1m bars is fetched at 1h/1d.
+            for table_name in DERIVED_TABLES:
+                end_dates[table_name] = (
+                    start_dates["stock1m"] - pd.Timedelta(days=1)
+                ).normalize()
+        return {
+            table_name: (
+                [(start_date.normalize(), end_dates[table_name])]
+                if start_date.normalize() <= end_dates[table_name]
+                and start_date < current_time
+                else []
+            )
+            for table_name, start_date in start_dates.items()
+        }
+
+    async def _process_symbol(self, symbol, emit, windows=None):
+        """Fetch new bars (or just ``windows``) of ``symbol`` into ``emit``;
+        returns True if every interval was fetched completely."""
+        loggers = self._setup_logger(symbol)
+        try:
+            if windows is None:
+                spans = await self._incremental_spans(symbol)
+            else:
+                spans = windows
+
+            derived = {table_name: [] for table_name in DERIVED_TABLES}
+            source = {table_name: [] for table_name in DERIVED_TABLES}
+
+            async def handle(table_name, bars):
+                await emit(table_name, bars, loggers)
+                if table_name == "stock1m" and self.derive is not None:
+                    for derived_table, unit in DERIVED_TABLES.items():
+                        with self.timings.time("transform", len(bars)):
+                            derived_bars = bars.resample(unit)
+                        if self.derive == "write":
+                            await emit(derived_table, derived_bars, loggers)
+                        else:
+                            derived[derived_table].append(derived_bars)
+                elif self.derive == "verify":
+                    source[table_name].append(bars)
 
-                if start_date < current_time:
+            async def fetch_interval(interval, table_name):
+                records = 0
+                for start_date, end_date in spans.get(table_name, []):
                     start_date_str = start_date.strftime("%Y-%m-%d")
-                    end_date_str = current_time.strftime("%Y-%m-%d")
+                    end_date_str = end_date.strftime("%Y-%m-%d")
 
                     loggers[table_name].info(
                         f"Fetching data for {symbol} from {start_date_str} to {end_date_str}"
                     )
 
-                    df = stock.quote.history(
-                        start=start_date_str,
-                        end=end_date_str,
-                        interval=_INTERVAL_MAP[interval],
-                    )
-
-                    if df is not None and not df.empty:
-                        df["symbol"] = symbol
-                        for col in ["open", "high", "low", "close"]:
-                            df[col] = df[col].astype(float)
-                        df["volume"] = df["volume"].astype(int)
-                        data[table_name] = df
-                        loggers[table_name].info(
-                            f"Retrieved {len(df)} records for {symbol} from {start_date_str} to {end_date_str}"
+                    span_records = 0
+                    try:
+                        async for bars in self._fetch_windows(
+                            symbol, interval, table_name, start_date, end_date
+                        ):
+                            span_records += len(bars)
+                            loggers[table_name].info(
+                                f"Retrieved {len(bars)} records for {symbol} "
+                                f"from {bars.start_time} to {bars.end_time}"
+                            )
+                            await handle(table_name, bars)
+                    except Exception as e:
+                        loggers[table_name].error(
+                            f"Error fetching {symbol} for {table_name} "
+                            f"after {records + span_records} records: {str(e)}"
                         )
-                    else:
+                        self._add_stat(table_name, "failed", 1)
+                        return False
+
+                    if span_records == 0:
                         loggers[table_name].warning(
                             f"No new data found for {symbol} in {table_name} from {start_date_str}"
                         )
-                        self.stats[table_name]["failed"] += 1
+                        self._add_stat(table_name, "failed", 1)
+                    records += span_records
+                return True
+
+            intervals = [("1h", "stock1h"), ("1d", "stock1d"), ("1m", "stock1m")]
+            if self.derive == "write":
+                # 1h/1d spans only reach back past the 1m horizon; fetch them
+                # first so each table's frames still arrive in time order.
+                results = [
+                    await fetch_interval(interval, table_name)
+                    for interval, table_name in intervals
+                ]
+            else:
+                results = await asyncio.gather(
+                    *(
+                        fetch_interval(interval, table_name)
+                        for interval, table_name in intervals
+                    )
+                )
 
-            return data, loggers
+            if self.derive == "verify":
+                self._verify_derived(symbol, derived, source, loggers)
+            # An interrupted fetch stops early; the symbol isn't done.
+            return all(results) and self.is_running
 
         except Exception as e:
             main_logger = logging.getLogger()
             main_logger.error(f"Error processing {symbol}: {str(e)}")
-            return None, loggers
+            return False
+
+    def _verify_derived(self, symbol, derived, source, loggers):
+        for table_name in DERIVED_TABLES:
+            if not derived[table_name] or not source[table_name]:
+                continue
+            result = Bars.concat(symbol, derived[table_name]).diff(
+                Bars.concat(symbol, source[table_name])
+            )
+            with self.stats_lock:
+                for key, value in result.items():
+                    self.derive_report[table_name][key] += value
+            log = loggers[table_name].info
+            if result["missing"] or result["extra"] or result["mismatched"]:
+                log = loggers[table_name].warning
+            log(
+                f"Derived {table_name} for {symbol}: {result['compared']} compared, "
+                f"{result['mismatched']} mismatched, {result['missing']} missing, "
+                f"{result['extra']} extra"
+            )
+
+    def _ensure_partitions(self, conn, table_name, times, logger):
+        try:
+            with self.timings.time("partition"):
+                created = self.partitions.ensure(conn, table_name, times)
+            if created:
+                logger.info(f"Created {created} partitions for {table_name}")
+        except Exception as e:
+            logger.error(f"Error creating partitions for {table_name}: {str(e)}")
 
-    def _save_chunk(self, df_chunk, table_name, symbol, loggers):
+    def _load_watermarks(self, symbols):
+        logger = logging.getLogger()
+        conn = self._getconn()
+        try:
+            self.watermarks.load(conn, symbols)
+            logger.info(
+                f"Loaded {len(self.watermarks.marks)} watermarks for {len(symbols)} symbols"
+            )
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error loading watermarks: {str(e)}")
+        finally:
+            self.pool.putconn(conn)
+
+    def _prepare_partitions(self, symbols):
+        """Load the partition catalog once and pre-create every partition the
+        run will write to, from the oldest symbol start up to today."""
+        logger = logging.getLogger()
+        conn = self._getconn()
+        try:
+            self.partitions.load(conn)
+            today = pd.Timestamp.now().normalize()
+            for table_name, start_date in self._oldest_starts(symbols, today).items():
+                created = self.partitions.prepare(conn, table_name, start_date, today)
+                logger.info(f"Pre-created {created} partitions for {table_name}")
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error preparing partitions: {str(e)}")
+        finally:
+            self.pool.putconn(conn)
+
+    def _oldest_starts(self, symbols, today):
+        """Per table, the earliest day any of ``symbols`` will be written from:
+        its watermark, or for a backfill its cached listing date (clamped to
+        the table's history horizon), as in _incremental_spans."""
+        horizon_starts = {
+            table_name: (today - horizon).normalize()
+            for table_name, horizon in HISTORY_HORIZONS.items()
+            if horizon is not None
+        }
+        oldest = {}
+        if not self.watermarks.loaded:
+            return oldest
+        for symbol in symbols:
+            last_dates = {
+                table_name: self.watermarks.get(symbol, table_name)
+                for table_name in self.partitions.UNITS
+            }
+            listing_date = None
+            if any(last_date is None for last_date in last_dates.values()):
+                if self.replay:
+                    listing_date = self.cache.earliest(symbol) or DEFAULT_LISTING_DATE
+                else:
+                    listing_date = self.listing_dates.get(symbol)
+            starts = {}
+            for table_name, last_date in last_dates.items():
+                start_date = last_date or listing_date
+                if start_date is None:
+                    # Listing date not looked up yet: the horizon bounds the
+                    # backfill where there is one, otherwise ensure() covers it.
+                    start_date = horizon_starts.get(table_name)
+                if start_date is not None:
+                    starts[table_name] = pd.Timestamp(start_date).tz_localize(None)
+            if self.derive == "write" and starts:
+                starts["stock1m"] = min(starts.values())
+            for table_name, start_date in starts.items():
+                if table_name in horizon_starts:
+                    start_date = max(start_date, horizon_starts[table_name])
+                if table_name not in oldest or start_date < oldest[table_name]:
+                    oldest[table_name] = start_date
+        return oldest
+
+    def _upsert_sql(self, table_name, incoming):
+        """Upsert the rows of the ``incoming`` query and select how many were
+        (inserted, updated); unchanged rows are not rewritten."""
+        # Partitioned tables can't return xmax, so the update and insert
+        # halves count their own RETURNING rows. $1 and $2 bound the update
+        # to the incoming span so its partitions are pruned.
+        return f"""
+            WITH incoming AS (
+                {incoming}
+            ),
+            updated AS (
+                UPDATE {table_name} t
+                SET
+                    open = s.open,
+                    high = s.high,
+                    low = s.low,
+                    close = s.close,
+                    volume = s.volume
+                FROM incoming s (ticker, datetime, open, high, low, close, volume)
+                WHERE t.ticker = s.ticker
+                AND t.datetime = s.datetime
+                AND t.datetime BETWEEN $1 AND $2
+                AND (t.open, t.high, t.low, t.close, t.volume) IS DISTINCT FROM (
+                    s.open::{PRICE_TYPE},
+                    s.high::{PRICE_TYPE},
+                    s.low::{PRICE_TYPE},
+                    s.close::{PRICE_TYPE},
+                    s.volume
+                )
+                RETURNING t.ticker, t.datetime
+            ),
+            inserted AS (
+                INSERT INTO {table_name}
+                    (ticker, datetime, open, high, low, close, volume)
+                SELECT *
+                FROM incoming s (ticker, datetime, open, high, low, close, volume)
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM updated u
+                    WHERE u.ticker = s.ticker AND u.datetime = s.datetime
+                )
+                ON CONFLICT (ticker, datetime) DO NOTHING
+                RETURNING 1
+            )
+            SELECT (SELECT count(*) FROM inserted), (SELECT count(*) FROM updated);
+        """
+
+    def _prepare_upsert(self, conn, table_name, source):
+        """Prepare on ``conn`` (once per session) the upsert of ``source``,
+        "staging" or "arrays", into ``table_name``; returns its name."""
+        if source == "staging":
+            # _bulk_load dedupes before COPY, as _save_chunk does.
+            incoming = f"""
+                SELECT ticker, datetime, open, high, low, close, volume
+                FROM {table_name}_staging
+            """
+            types = _UPSERT_ARRAY_TYPES[:2]
+        else:
+            incoming = "SELECT * FROM unnest($3, $4, $5, $6, $7, $8, $9)"
+            types = _UPSERT_ARRAY_TYPES
+        with self._sql_timer(table_name, "prepare"):
+            return conn.prepare(
+                f"upsert_{table_name}_{source}",
+                self._upsert_sql(table_name, incoming),
+                types,
+            )
+
+    @staticmethod
+    def _execute_upsert(cur, statement, params):
+        """Run a prepared upsert; returns (inserted, updated)."""
+        cur.execute(f"EXECUTE {statement} ({', '.join(['%s'] * len(params))})", params)
+        return cur.fetchone()
+
+    @staticmethod
+    def _time_bounds(times):
+        return np.datetime_as_string(times.min()), np.datetime_as_string(times.max())
+
+    @staticmethod
+    def _array_params(parts):
+        """Parameters of the "arrays" upsert for the bars in ``parts``, each
+        column as one array literal."""
+        tickers = np.repeat([bars.symbol for bars in parts], [len(b) for b in parts])
+        times = np.concatenate([bars.times for bars in parts])
+
+        def literal(values):
+            return "{" + ",".join(values) + "}"
+
+        return (
+            *StockDataProcessor._time_bounds(times),
+            literal(f'"{ticker}"' for ticker in tickers.tolist()),
+            literal(np.datetime_as_string(times, unit="us").tolist()),
+            *(
+                literal(
+                    map(
+                        repr,
+                        np.concatenate([getattr(b, field) for b in parts]).tolist(),
+                    )
+                )
+                for field in ("open", "high", "low", "close", "volume")
+            ),
+        )
+
+    @staticmethod
+    def _copy_text_payload(bars):
+        frame = pd.DataFrame(
+            {
+                "ticker": bars.symbol,
+                "datetime": bars.times,
+                "open": bars.open,
+                "high": bars.high,
+                "low": bars.low,
+                "close": bars.close,
+                "volume": bars.volume,
+            }
+        )
+        buf = io.StringIO()
+        frame.to_csv(
+            buf,
+            sep="\t",
+            header=False,
+            index=False,
+            na_rep="\\N",
+            date_format="%Y-%m-%d %H:%M:%S",
+        )
+        buf.seek(0)
+        return buf
+
+    @staticmethod
+    def _copy_binary_payload(bars):
+        ticker = bars.symbol.encode("utf-8")
+        row_type = np.dtype(
+            [
+                ("fields", ">i2"),
+                ("ticker_len", ">i4"),
+                ("ticker", f"S{len(ticker)}"),
+                ("datetime_len", ">i4"),
+                ("datetime", ">i8"),
+                ("open_len", ">i4"),
+                ("open", ">f8"),
+                ("high_len", ">i4"),
+                ("high", ">f8"),
+                ("low_len", ">i4"),
+                ("low", ">f8"),
+                ("close_len", ">i4"),
+                ("close", ">f8"),
+                ("volume_len", ">i4"),
+                ("volume", ">i8"),
+            ]
+        )
+        rows = np.empty(len(bars), dtype=row_type)
+        rows["fields"] = 7
+        rows["ticker_len"] = len(ticker)
+        rows["ticker"] = ticker
+        rows["datetime_len"] = 8
+        rows["datetime"] = (bars.times - _PG_EPOCH).astype(np.int64)
+        for col in ["open", "high", "low", "close"]:
+            rows[f"{col}_len"] = 8
+            rows[col] = getattr(bars, col)
+        rows["volume_len"] = 8
+        rows["volume"] = bars.volume
+
+        return io.BytesIO(_COPY_BINARY_HEADER + rows.tobytes() + _COPY_BINARY_TRAILER)
+
+    def _bulk_load(self, conn, bars, table_name, symbol, loggers):
+        """COPY a chunk into staging and upsert it; returns the rows accounted
+        for, or None to fall back to the "arrays" upsert."""
         if not self.is_running:
             return 0
 
         logger = loggers[table_name]
+        started = time.perf_counter()
 
         try:
-            # Prepare data
-            df_chunk = df_chunk.copy()
-            df_chunk["datetime"] = (
-                pd.to_datetime(df_chunk["time"])
-                .dt.tz_localize("Asia/Ho_Chi_Minh")
-                .dt.tz_convert("UTC")
-                .dt.tz_localize(None)
-            )
-            df_chunk = df_chunk.sort_values("datetime")
-
             chunk_info = {
                 "symbol": symbol,
                 "table": table_name,
-                "start_time": df_chunk["datetime"].min(),
-                "end_time": df_chunk["datetime"].max(),
-                "record_count": len(df_chunk),
+                "start_time": bars.start_time,
+                "end_time": bars.end_time,
+                "record_count": len(bars),
             }
 
-            logger.info(f"Processing chunk for {symbol} in {table_name}")
-            self._save_checkpoint(symbol, table_name, chunk_info)
+            with self.timings.time("transform", len(bars)):
+                # Keep the last of duplicate bars and count them once, like
+                # the "arrays" upsert.
+                bars = bars.dedupe()
+                if self.load_mode == "copy_binary":
+                    payload = self._copy_binary_payload(bars)
+                    copy_format = "BINARY"
+                else:
+                    payload = self._copy_text_payload(bars)
+                    copy_format = "TEXT"
+        except Exception as e:
+            logger.error(f"Error preparing bulk load for {symbol}: {str(e)}")
+            return None
 
-            data = [
-                (
-                    symbol,
-                    row["datetime"],
-                    float(row["open"]),
-                    float(row["high"]),
-                    float(row["low"]),
-                    float(row["close"]),
-                    int(row["volume"]) if pd.notna(row["volume"]) else 0,
-                )
-                for _, row in df_chunk.iterrows()
-            ]
+        staging_table = f"{table_name}_staging"
+        try:
+            with conn.cursor() as cur:
+                self._ensure_partitions(conn, table_name, bars.times, logger)
+
+                insert_started = time.perf_counter()
+                with self._sql_timer(table_name, "create_staging"):
+                    cur.execute(
+                        f"""
+                        CREATE TEMP TABLE IF NOT EXISTS {staging_table} (
+                            ticker varchar(12),
+                            datetime timestamp,
+                            open float8,
+                            high float8,
+                            low float8,
+                            close float8,
+                            volume bigint
+                        ) ON COMMIT DELETE ROWS;
+                        """
+                    )
+                with self._sql_timer(table_name, "copy"):
+                    cur.copy_expert(
+                        f"COPY {staging_table} FROM STDIN WITH (FORMAT {copy_format})",
+                        payload,
+                    )
+                statement = self._prepare_upsert(conn, table_name, "staging")
+                with self._sql_timer(table_name, "merge"):
+                    inserted, updated = self._execute_upsert(
+                        cur, statement, self._time_bounds(bars.times)
+                    )
+                with self._sql_timer(table_name, "commit"):
+                    conn.commit()
+                insert_seconds = time.perf_counter() - insert_started
+                self.timings.add("insert", insert_seconds, len(bars))
+                self.tuner.record(len(bars), insert_seconds)
 
-            if not data:
-                logger.error("No valid records to insert")
-                return 0
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error during bulk load ({self.load_mode}): {str(e)}")
+            return None
 
-            conn = self.pool.getconn()
-            try:
-                with conn.cursor() as cur:
-                    if table_name == "stock1m":
-                        unique_days = df_chunk["datetime"].dt.to_period("D").unique()
-                        for period in unique_days:
-                            start_date = period.to_timestamp()
-                            end_date = (period + 1).to_timestamp()
-                            partition_name = (
-                                f"{table_name}_{start_date.strftime('%Y_%m_%d')}"
-                            )
+        elapsed = time.perf_counter() - started
+        processed_count = len(bars)
+        self.watermarks.advance(symbol, table_name, bars.end_time)
+        if inserted or updated:
+            self.maintenance.touch(table_name, bars.times)
+        self._record_upsert(table_name, processed_count, inserted, updated)
+        self._add_stat(table_name, "load_seconds", elapsed)
+        self._mark_committed(symbol, table_name, bars.end_time)
+
+        logger.info(
+            f"Bulk loaded {processed_count} records ({inserted} inserted, "
+            f"{updated} updated, {processed_count - inserted - updated} unchanged) "
+            f"for {symbol} in {table_name} via {self.load_mode} "
+            f"from {chunk_info['start_time']} to {chunk_info['end_time']} "
+            f"({processed_count / elapsed if elapsed else 0:.0f} rows/sec)"
+        )
+        return processed_count
 
-                            try:
-                                cur.execute(
-                                    f"""
-                                    DO $$
-                                    BEGIN
-                                        IF NOT EXISTS (
-                                            SELECT 1 FROM pg_class c
-                                            JOIN pg_namespace n ON n.oid = c.relnamespace
-                                            WHERE c.relname = '{partition_name}'
-                                            AND n.nspname = 'public'
-                                        ) THEN
-                                            CREATE TABLE {partition_name}
-                                            PARTITION OF {table_name}
-                                            FOR VALUES FROM (%s) TO (%s);
-                                        END IF;
-                                    END $$;
-                                    """,
-                                    (start_date, end_date),
-                                )
-                                conn.commit()
-                            except Exception as e:
-                                logger.error(
-                                    f"Error creating partition {partition_name}: {str(e)}"
-                                )
-                                continue
-                    else:
-                        unique_months = df_chunk["datetime"].dt.to_period("M").unique()
-                        for period in unique_months:
-                            start_date = period.to_timestamp()
-                            end_date = (period + 1).to_timestamp()
-                            partition_name = (
-                                f"{table_name}_{start_date.strftime('%Y_%m')}"
-                            )
+    def _record_upsert(self, table_name, total, inserted, updated):
+        self._add_stat(table_name, "processed", total)
+        self._add_stat(table_name, "inserted", inserted)
+        self._add_stat(table_name, "updated", updated)
+        self._add_stat(table_name, "unchanged", total - inserted - updated)
 
-                            try:
-                                cur.execute(
-                                    f"""
-                                    DO $$
-                                    BEGIN
-                                        IF NOT EXISTS (
-                                            SELECT 1 FROM pg_class c
-                                            JOIN pg_namespace n ON n.oid = c.relnamespace
-                                            WHERE c.relname = '{partition_name}'
-                                            AND n.nspname = 'public'
-                                        ) THEN
-                                            CREATE TABLE {partition_name}
-                                            PARTITION OF {table_name}
-                                            FOR VALUES FROM (%s) TO (%s);
-                                        END IF;
-                                    END $$;
-                                    """,
-                                    (start_date, end_date),
-                                )
-                                conn.commit()
-                            except Exception as e:
-                                logger.error(
-                                    f"Error creating partition {partition_name}: {str(e)}"
-                                )
-                                continue
+    def _save_chunk(self, conn, bars, table_name, symbol, loggers):
+        if not self.is_running:
+            return 0
 
-                    try:
-                        execute_batch(
-                            cur,
-                            f"""
-                            INSERT INTO {table_name}
-                                (ticker, datetime, open, high, low, close, volume)
-                            VALUES (%s, %s::timestamptz, %s, %s, %s, %s, %s)
-                            ON CONFLICT (ticker, datetime) 
-                            DO UPDATE SET 
-                                open = EXCLUDED.open,
-                                high = EXCLUDED.high,
-                                low = EXCLUDED.low,
-                                close = EXCLUDED.close,
-                                volume = EXCLUDED.volume;
-                            """,
-                            data,
-                            page_size=CHUNK_SIZE,
-                        )
+        logger = loggers[table_name]
+        started = time.perf_counter()
 
-                        cur.execute(
-                            f"""
-                            SELECT COUNT(*) FROM {table_name}
-                            WHERE ticker = %s
-                            AND datetime BETWEEN %s::timestamptz AND %s::timestamptz;
-                            """,
-                            (symbol, chunk_info["start_time"], chunk_info["end_time"]),
-                        )
+        try:
+            chunk_info = {
+                "symbol": symbol,
+                "table": table_name,
+                "start_time": bars.start_time,
+                "end_time": bars.end_time,
+                "record_count": len(bars),
+            }
 
-                        processed_count = cur.fetchone()[0]
-                        conn.commit()
+            logger.info(f"Processing chunk for {symbol} in {table_name}")
 
-                        partition_format = (
-                            "%Y_%m_%d" if table_name == "stock1m" else "%Y_%m"
-                        )
-                        logger.info(
-                            f"Successfully processed {processed_count}/{chunk_info['record_count']} records "
-                            f"for {symbol} in {table_name} "
-                            f"(partition: {table_name}_{chunk_info['start_time'].strftime(partition_format)}) "
-                            f"from {chunk_info['start_time']} to {chunk_info['end_time']}"
-                        )
+            with self.timings.time("transform", len(bars)):
+                deduped = bars.dedupe()
+                params = self._array_params([deduped]) if len(deduped) else None
 
-                        if processed_count > 0:
-                            self.stats[table_name]["processed"] += processed_count
-                            if os.path.exists(self.checkpoint_file):
-                                os.remove(self.checkpoint_file)
-                        else:
-                            self.stats[table_name]["failed"] += len(data)
+            if params is None:
+                logger.error("No valid records to insert")
+                return 0
 
-                        return processed_count
+            with conn.cursor() as cur:
+                self._ensure_partitions(conn, table_name, bars.times, logger)
+
+                try:
+                    insert_started = time.perf_counter()
+                    statement = self._prepare_upsert(conn, table_name, "arrays")
+                    with self._sql_timer(table_name, "upsert"):
+                        inserted, updated = self._execute_upsert(cur, statement, params)
+                    processed_count = len(deduped)
+                    with self._sql_timer(table_name, "commit"):
+                        conn.commit()
+                    insert_seconds = time.perf_counter() - insert_started
+                    self.timings.add("insert", insert_seconds, processed_count)
+                    self.tuner.record(processed_count, insert_seconds)
+                    self.watermarks.advance(symbol, table_name, chunk_info["end_time"])
+                    if inserted or updated:
+                        self.maintenance.touch(table_name, bars.times)
+
+                    # Named from the registry: the day may sit in a merged
+                    # partition.
+                    partition_name = ", ".join(
+                        self.partitions.partition_names(
+                            table_name,
+                            self.partitions.periods(table_name, bars.times[:1]),
+                        )
+                    )
+                    logger.info(
+                        f"Successfully processed {processed_count}/{chunk_info['record_count']} records "
+                        f"({inserted} inserted, {updated} updated, "
+                        f"{processed_count - inserted - updated} unchanged) "
+                        f"for {symbol} in {table_name} "
+                        f"(partition: {partition_name}) "
+                        f"from {chunk_info['start_time']} to {chunk_info['end_time']}"
+                    )
 
-                    except Exception as e:
-                        conn.rollback()
-                        logger.error(f"Error during data insertion: {str(e)}")
-                        raise
+                    self._add_stat(
+                        table_name, "load_seconds", time.perf_counter() - started
+                    )
+                    self._record_upsert(table_name, processed_count, inserted, updated)
+                    self._mark_committed(symbol, table_name, chunk_info["end_time"])
 
-            finally:
-                self.pool.putconn(conn)
+                    return processed_count
+
+                except Exception as e:
+                    conn.rollback()
+                    logger.error(f"Error during data insertion: {str(e)}")
+                    raise
 
         except Exception as e:
             logger.error(f"Error in _save_chunk: {str(e)}")
-            self.stats[table_name]["failed"] += len(df_chunk)
+            self._add_stat(table_name, "failed", len(bars))
             return 0
 
-    def process_symbols(self, symbols):
+    def _write_frame(self, conn, bars, table_name, loggers):
+        """Write one fetched frame; returns False if interrupted or a chunk
+        failed, leaving the symbol unfinished."""
         main_logger = logging.getLogger()
-        completed = self._load_progress()
+        symbol = bars.symbol
+        total_records = len(bars)
+        if (symbol, table_name) in self.failed_streams:
+            return False
+
+        # Bars before the mark an interrupted run committed for this stream
+        # are already stored; the marked bar itself is rewritten in case it
+        # was still forming.
+        start_index = 0
+        resume_mark = self.resume_marks.get((symbol, table_name))
+        if resume_mark is not None:
+            start_index = int(np.searchsorted(bars.times, resume_mark))
+            if start_index:
+                main_logger.info(
+                    f"Resuming {symbol} in {table_name} from index {start_index}"
+                )
+            if start_index == total_records:
+                return True
+
+        bulk = self.load_mode != "batch"
+        i = start_index
+        while i < total_records:
+            if not self.is_running:
+                # Committed chunks are already in the journal.
+                main_logger.info(f"Stopped {symbol} in {table_name} at index {i}")
+                return False
+
+            chunk = bars[i : i + self.tuner.chunk_size]
+            processed = None
+            if bulk:
+                processed = self._bulk_load(conn, chunk, table_name, symbol, loggers)
+                if processed is None:
+                    main_logger.warning(
+                        f"Bulk load failed for {symbol} in {table_name}, "
+                        f"falling back to batch inserts"
+                    )
+                    bulk = False
+            if processed is None:
+                processed = self._save_chunk(conn, chunk, table_name, symbol, loggers)
+            if not processed:
+                if self.is_running:
+                    # Later bars of this stream are not written either, so
+                    # its marks never move past the failed chunk.
+                    with self.stats_lock:
+                        self.failed_streams.add((symbol, table_name))
+                    main_logger.error(
+                        f"Stopped {symbol} in {table_name} at index {i}: write failed"
+                    )
+                return False
+            i += len(chunk)
+
+        return self.is_running
+
+    def pipeline_status(self):
+        write_queue = self.pipeline.get("queue")
+        if write_queue is None:
+            return {}
+        return {
+            "queue_depth": write_queue.qsize(),
+            "queue_capacity": write_queue.maxsize,
+            "fetch": self.pipeline["fetch"].status(),
+            "write": self.pipeline["write"].status(),
+        }
+
+    def _log_pipeline(self):
+        status = self.pipeline_status()
+        tuning = self.tuner.status()
+        logging.getLogger().info(
+            f"Pipeline: queue {status['queue_depth']}/{status['queue_capacity']}, "
+            f"fetch {status['fetch']['items']} symbols "
+            f"({status['fetch']['utilisation']:.0%} busy), "
+            f"write {status['write']['items']} frames "
+            f"({status['write']['utilisation']:.0%} busy, "
+            f"{tuning['writers']} writers, {tuning['chunk_size']} rows per chunk)"
+        )
+
+    def process_symbols(self, symbols, skip_completed=True, windows=None):
+        """Crawl ``symbols`` (only ``windows`` of them, for a repair that
+        skips the journal); returns the ones completed by this call."""
+        main_logger = logging.getLogger()
+        self.journal.load()
+        completed = set(self.journal.done) if skip_completed else set()
         symbols = [s for s in symbols if s not in completed]
-        checkpoint = self._load_checkpoint()
+        self.repairing = windows is not None
+        self.resume_marks = {} if self.repairing else dict(self.journal.marks)
+        self.failed_streams = set()
 
-        if checkpoint:
+        if self.resume_marks:
             main_logger.info(
-                f"Resuming from checkpoint: Symbol={checkpoint['symbol']}, "
-                f"Table={checkpoint['table_name']}, "
-                f"Time range={checkpoint['chunk_info']['start_time']} to "
-                f"{checkpoint['chunk_info']['end_time']}"
+                f"Resuming {len(self.resume_marks)} interrupted streams "
+                f"from the progress journal"
             )
 
-        self.stats = {
-            "stock1m": {"processed": 0, "failed": 0},
-            "stock1h": {"processed": 0, "failed": 0},
-            "stock1d": {"processed": 0, "failed": 0},
-        }
+        self.table_stats = TableStats(self.metrics)
+        self.timings = StageTimings(self.metrics)
+        self.sql_baseline = self._sql_totals()
+        self.derive_report = self._empty_derive_report()
+        self._load_watermarks(symbols)
+        self.listing_dates.load()
+        self._prepare_partitions(symbols)
 
         main_logger.info(f"Processing {len(symbols)} symbols")
         start_time = datetime.now()
 
+        # Fetchers push frames into a bounded queue (blocking when it is full,
+        # so memory stays flat); writers, each on its own connection, drain it
+        # in completion order.
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        fetch_stage = PipelineStage("fetch", self.fetch_workers)
+        write_stage = PipelineStage("write", self.writer_workers, slots=self.tuner)
+        self.pipeline = {
+            "queue": write_queue,
+            "fetch": fetch_stage,
+            "write": write_stage,
+        }
+        progress_lock = threading.Lock()
+        # symbol -> frames queued but not yet written, and whether its fetch
+        # has finished cleanly; a symbol completes when both settle.
+        pending_frames = {}
+        fetched = set()
+
+        def settle(symbol):
+            if pending_frames.get(symbol) == 0 and symbol in fetched:
+                del pending_frames[symbol]
+                completed.add(symbol)
+                if not self.repairing:
+                    self.journal.finish(symbol)
+
+        def enqueue(table_name, bars, loggers):
+            with progress_lock:
+                pending_frames[bars.symbol] = pending_frames.get(bars.symbol, 0) + 1
+            write_queue.put((table_name, bars, loggers))
+
+        async def fetch(symbol, symbol_slots):
+            async with symbol_slots:
+                if not self.is_running:
+                    return
+                blocked = 0.0
+
+                async def emit(table_name, bars, loggers):
+                    nonlocal blocked
+                    # put() blocks while the queue is full; keep that off the
+                    # loop, and out of the fetch stage's busy time.
+                    waited = time.perf_counter()
+                    await asyncio.to_thread(enqueue, table_name, bars, loggers)
+                    blocked += time.perf_counter() - waited
+
+                started = time.perf_counter()
+                ok = await self._process_symbol(
+                    symbol, emit, None if windows is None else windows[symbol]
+                )
+                fetch_stage.record(time.perf_counter() - started - blocked)
+
+            if ok:
+                # A clean fetch with nothing new completes the symbol too.
+                with progress_lock:
+                    pending_frames.setdefault(symbol, 0)
+                    fetched.add(symbol)
+                    settle(symbol)
+
+        async def report():
+            while True:
+                await asyncio.sleep(PIPELINE_REPORT_INTERVAL)
+                self._log_pipeline()
+                await asyncio.to_thread(self._export_metrics)
+
+        async def fetch_all():
+            self.listing_lookups = {}
+            symbol_slots = asyncio.Semaphore(self.fetch_workers)
+            reporter = asyncio.create_task(report())
+            try:
+                await asyncio.gather(
+                    self._refresh_listing_dates(symbols),
+                    *(fetch(symbol, symbol_slots) for symbol in symbols),
+                )
+            finally:
+                reporter.cancel()
+
+        def write():
+            try:
+                while True:
+                    # Only the tuner's active writers take frames.
+                    with self.tuner.slot():
+                        item = write_queue.get()
+                        if item is None:
+                            break
+                        table_name, bars, loggers = item
+                        if not self.is_running:
+                            continue
+
+                        # A connection per frame, so only active writers hold
+                        # one; the pool hands back the most recently used,
+                        # with its statements already prepared.
+                        conn = self._getconn()
+                        started = time.perf_counter()
+                        try:
+                            with self._profile(bars.symbol):
+                                finished = self._write_frame(
+                                    conn, bars, table_name, loggers
+                                )
+                        finally:
+                            self.pool.putconn(conn)
+                        write_stage.record(time.perf_counter() - started)
+                    if not finished:
+                        continue
+
+                    with progress_lock:
+                        pending_frames[bars.symbol] -= 1
+                        settle(bars.symbol)
+            except Exception as e:
+                main_logger.error(f"Writer error: {str(e)}")
+                self.is_running = False
+                # Keep draining so fetchers blocked on put() can exit.
+                while write_queue.get() is not None:
+                    pass
+
+        # In concurrent mode, partitions every unsettled symbol has moved past
+        # are vacuumed while the run is still writing newer ones.
+        stop_maintainer = threading.Event()
+
+        def maintain():
+            while not stop_maintainer.wait(MAINTENANCE_INTERVAL):
+                with progress_lock:
+                    unsettled = [s for s in symbols if s not in completed]
+                self._maintenance(self._finished_before(unsettled))
+
+        writers = [
+            threading.Thread(target=write, name=f"writer-{i}", daemon=True)
+            for i in range(self.writer_workers)
+        ]
+        for writer in writers:
+            writer.start()
+        maintainer = None
+        if self.maintenance_mode == "concurrent":
+            maintainer = threading.Thread(
+                target=maintain, name="maintainer", daemon=True
+            )
+            maintainer.start()
+
         try:
-            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-                for result_tuple in executor.map(self._process_symbol, symbols):
-                    if not self.is_running:
-                        main_logger.info("Stopping processing due to interrupt...")
-                        break
-
-                    if result_tuple is not None:
-                        result, loggers = result_tuple
-                        symbol = None
-
-                        for table_name, df in result.items():
-                            if df is not None and not df.empty:
-                                symbol = df["symbol"].iloc[0]
-                                total_records = len(df)
-                                processed_records = 0
-
-                                start_index = 0
-                                if (
-                                    checkpoint
-                                    and symbol == checkpoint["symbol"]
-                                    and table_name == checkpoint["table_name"]
-                                ):
-                                    checkpoint_start_time = checkpoint["chunk_info"][
-                                        "start_time"
-                                    ]
-                                    start_index = df[
-                                        df["time"] >= checkpoint_start_time
-                                    ].index[0]
-                                    main_logger.info(
-                                        f"Resuming from index {start_index}"
-                                    )
-
-                                # Process chunks
-                                for i in range(start_index, len(df), CHUNK_SIZE):
-                                    if not self.is_running:
-                                        # Save checkpoint before exit
-                                        chunk_info = {
-                                            "start_time": df.iloc[i]["time"],
-                                            "end_time": df.iloc[
-                                                min(i + CHUNK_SIZE, len(df) - 1)
-                                            ]["time"],
-                                        }
-                                        self._save_checkpoint(
-                                            symbol, table_name, chunk_info
-                                        )
-                                        main_logger.info(
-                                            f"Saved checkpoint at index {i}"
-                                        )
-                                        return
-
-                                    chunk = df.iloc[i : i + CHUNK_SIZE]
-                                    processed = self._save_chunk(
-                                        chunk, table_name, symbol, loggers
-                                    )
-                                    processed_records += processed
-
-                                if processed_records == 0:
-                                    self.stats[table_name]["failed"] += total_records
-
-                        if symbol:
-                            completed.add(symbol)
-                            self._save_progress(completed)
-                            if os.path.exists(self.checkpoint_file):
-                                os.remove(self.checkpoint_file)
+            asyncio.run(fetch_all())
+
+            if not self.is_running:
+                main_logger.info("Stopping processing due to interrupt...")
 
         except Exception as e:
             main_logger.error(f"Error during processing: {str(e)}")
+            self.is_running = False
             raise
 
         finally:
+            for _ in writers:
+                write_queue.put(None)
+            for writer in writers:
+                while writer.is_alive():
+                    writer.join(PIPELINE_REPORT_INTERVAL)
+                    if writer.is_alive():
+                        self._log_pipeline()
+            self._log_pipeline()
+            stop_maintainer.set()
+            if maintainer is not None:
+                maintainer.join()
+
+            self.journal.close()
+            self.listing_dates.save()
             duration = datetime.now() - start_time
             main_logger.info(f"Processing completed in {duration}")
 
             for table_name, stats in self.stats.items():
+                rows_per_sec = (
+                    stats["processed"] / stats["load_seconds"]
+                    if stats["load_seconds"]
+                    else 0
+                )
+                main_logger.info(
+                    f"{table_name}: Processed {stats['processed']} records "
+                    f"({stats['inserted']} inserted, {stats['updated']} updated, "
+                    f"{stats['unchanged']} unchanged and skipped), "
+                    f"Failed {stats['failed']} records, "
+                    f"{rows_per_sec:.0f} rows/sec ({self.load_mode})"
+                )
+
+            for stage, totals in self.timings.snapshot().items():
+                if totals["calls"]:
+                    main_logger.info(
+                        f"{stage}: {totals['seconds']:.2f}s over {totals['calls']} calls, "
+                        f"{totals['rows_per_sec']:.0f} rows/sec"
+                    )
+
+            if self.derive == "verify":
+                for table_name, report in self.derive_report.items():
+                    main_logger.info(
+                        f"{table_name} derived vs source: {report['compared']} compared, "
+                        f"{report['mismatched']} mismatched, "
+                        f"{report['missing']} missing, {report['extra']} extra"
+                    )
+
+            for statement, summary in sorted(self._sql_summary().items()):
+                main_logger.info(
+                    f"SQL {statement}: {summary['sum']:.2f}s over "
+                    f"{summary['count']} statements"
+                )
+            if self.cache is not None:
                 main_logger.info(
-                    f"{table_name}: Processed {stats['processed']} records, "
-                    f"Failed {stats['failed']} records"
+                    f"Raw cache: {self.cache.stats['hits']} periods hit, "
+                    f"{self.cache.stats['misses']} missed, "
+                    f"{self.cache.stats['writes']} written, "
+                    f"{self.cache.stats['evictions']} evicted, "
+                    f"{self.cache.size / 1024**2:.0f} MB"
                 )
+            self._export_metrics()
+            if self.profiler is not None:
+                profile_path = self.profiler.dump()
+                if profile_path:
+                    main_logger.info(f"Wrote profile to {profile_path}")
+
+        return completed.intersection(symbols)
+
+    def work_queue(self, jobs, claim_size=None):
+        """Claim batches of symbols from ``jobs`` and crawl them until the
+        queue has nothing left to claim (or the process is interrupted)."""
+        main_logger = logging.getLogger()
+        claim_size = claim_size or self.fetch_workers * 2
+        jobs.start()
+        try:
+            while self.is_running:
+                symbols = jobs.claim(claim_size)
+                if not symbols:
+                    break
+                main_logger.info(f"Worker {jobs.worker} claimed {len(symbols)} symbols")
+                completed = self.process_symbols(symbols, skip_completed=False)
+                done, retry = jobs.complete(symbols, completed)
+                main_logger.info(
+                    f"Worker {jobs.worker}: {done} symbols done, {retry} requeued"
+                )
+        finally:
+            jobs.close()
+        main_logger.info(f"Job queue: {jobs.counts()}")
+
+    def _day_counts(self, symbols, table_name, since=None):
+        """Stored bars per (ticker, local trading day) of ``table_name``, in
+        one grouped query: arrays of tickers, days and counts."""
+        offset = int(MARKET_UTC_OFFSET / np.timedelta64(1, "h"))
+        conn = self._getconn()
+        try:
+            with conn.cursor() as cur:
+                with self._sql_timer(table_name, "day_counts"):
+                    cur.execute(
+                        f"""
+                        SELECT ticker, (datetime + interval '{offset} hours')::date, count(*)
+                        FROM {table_name}
+                        WHERE ticker = ANY(%s)
+                        AND datetime >= %s
+                        GROUP BY 1, 2
+                        """,
+                        (list(symbols), since or DEFAULT_LISTING_DATE),
+                    )
+                    rows = cur.fetchall()
+            conn.commit()
+        finally:
+            self.pool.putconn(conn)
+        if not rows:
+            return np.array([], dtype=object), np.array([], "datetime64[D]"), []
+        tickers, days, counts = zip(*rows)
+        return np.array(tickers), np.array(days, dtype="datetime64[D]"), counts
+
+    def find_gaps(self, symbols, calendar=None, since=None, min_fill=GAP_MIN_FILL):
+        """Day ranges to refetch, as {symbol: {table: [(start, end)]}}."""
+        calendar = calendar or TradingCalendar()
+        gaps = {}
+        for table_name, unit in TABLE_UNITS.items():
+            tickers, days, counts = self._day_counts(symbols, table_name, since)
+            windows = gap_windows(tickers, days, counts, calendar, unit, min_fill)
+            for symbol, spans in windows.items():
+                gaps.setdefault(symbol, {})[table_name] = spans
+        return gaps
+
+    def repair_gaps(self, symbols, calendar=None, since=None):
+        """Find gaps in the stored bars of ``symbols`` and refetch only
+        those windows; returns the symbols fully repaired."""
+        main_logger = logging.getLogger()
+        calendar = calendar or TradingCalendar()
+        if since is None or since < calendar.covered_from:
+            main_logger.info(
+                f"Holidays before {calendar.covered_from} are unknown: days "
+                f"no symbol has bars for are taken as closures"
+            )
+        gaps = self.find_gaps(symbols, calendar, since)
+        for table_name in TABLE_UNITS:
+            windows = [
+                window
+                for tables in gaps.values()
+                for window in tables.get(table_name, [])
+            ]
+            if windows:
+                days = sum(
+                    len(calendar.trading_days(start, end)) for start, end in windows
+                )
+                affected = sum(table_name in tables for tables in gaps.values())
+                main_logger.info(
+                    f"{table_name}: {len(windows)} gaps covering {days} trading "
+                    f"days across {affected} symbols"
+                )
+        if not gaps:
+            main_logger.info(f"No gaps found for {len(symbols)} symbols")
+            return set()
+        if self.derive == "write":
+            # 1h/1d are rebuilt from 1m, so refetch 1m over all their gaps
+            # that the 1m history still covers; older ones at their own
+            # interval.
+            horizon = HISTORY_HORIZONS["stock1m"]
+            oldest = (
+                pd.Timestamp.now().normalize() - horizon
+                if horizon is not None
+                else pd.Timestamp.min
+            )
+            for tables in gaps.values():
+                spans = []
+                older = {}
+                for table_name, windows in tables.items():
+                    for start, end in windows:
+                        if table_name in DERIVED_TABLES and start < oldest:
+                            older.setdefault(table_name, []).append(
+                                (start, min(end, oldest - pd.Timedelta(days=1)))
+                            )
+                            start = oldest
+                        if start <= end:
+                            spans.append((start, end))
+                tables.clear()
+                tables.update(older)
+                if not spans:
+                    continue
+                spans.sort()
+                merged = [spans[0]]
+                for start, end in spans[1:]:
+                    if start <= merged[-1][1] + pd.Timedelta(days=1):
+                        merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+                    else:
+                        merged.append((start, end))
+                tables["stock1m"] = merged
+        return self.process_symbols(list(gaps), skip_completed=False, windows=gaps)
+
+    async def _fetch_latest(self, symbol, day):
+        """``day``'s 1m bars for ``symbol`` from its watermark on. The stored
+        last bar is included: it may have been written while still forming."""
+        started = time.perf_counter()
+        df = await self.fetcher.history(
+            symbol, start=day, end=day, interval=_INTERVAL_MAP["1m"]
+        )
+        rows = 0 if df is None else len(df)
+        self.timings.add("fetch", time.perf_counter() - started, rows)
+        if not rows:
+            return None
+        with self.timings.time("transform", rows):
+            bars = Bars.from_frame(symbol, df)
+        mark = self.watermarks.get(symbol, "stock1m")
+        if mark is not None:
+            bars = bars[int(np.searchsorted(bars.times, np.datetime64(mark, "us"))) :]
+        return bars if len(bars) else None
+
+    def _write_live(self, conn, deltas, since):
+        """Upsert one live round's bars in one transaction; returns (rows,
+        inserted, updated, close-to-commit latencies)."""
+        table_name = "stock1m"
+        logger = logging.getLogger()
+        deltas = [bars.dedupe() for bars in deltas]
+        times = np.concatenate([bars.times for bars in deltas])
+        self._ensure_partitions(conn, table_name, times, logger)
+        statement = self._prepare_upsert(conn, table_name, "arrays")
+        with conn.cursor() as cur:
+            with self._sql_timer(table_name, "upsert"):
+                inserted, updated = self._execute_upsert(
+                    cur, statement, self._array_params(deltas)
+                )
+            with self._sql_timer(table_name, "commit"):
+                conn.commit()
+        committed = np.datetime64(time.time_ns() // 1000, "us")
+
+        # A bar counts once: when first stored if it had already closed,
+        # otherwise when it is rewritten after closing.
+        latencies = []
+        for bars in deltas:
+            closes = bars.times + np.timedelta64(1, "m")
+            counted = (closes > since) & (closes <= committed)
+            mark = self.watermarks.get(bars.symbol, table_name)
+            last_commit = self.live_commits.get(bars.symbol)
+            if mark is not None and last_commit is not None:
+                counted &= (bars.times > np.datetime64(mark, "us")) | (
+                    closes > last_commit
+                )
+            latencies.append((committed - closes[counted]) / np.timedelta64(1, "s"))
+            self.watermarks.advance(bars.symbol, table_name, bars.end_time)
+            self.live_commits[bars.symbol] = committed
+        latencies = np.concatenate(latencies)
+        for latency in latencies.tolist():
+            self.live_latency.observe(latency)
+
+        if inserted or updated:
+            self.maintenance.touch(table_name, times)
+        self._record_upsert(table_name, len(times), inserted, updated)
+        return len(times), inserted, updated, latencies
+
+    async def _sleep_until(self, calendar, at):
+        while self.is_running:
+            remaining = (at - calendar.now()).total_seconds()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(remaining, 1.0))
+
+    async def _live_round(self, conn, symbols, day, since):
+        logger = logging.getLogger()
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(self._fetch_latest(symbol, day) for symbol in symbols),
+            return_exceptions=True,
+        )
+        deltas = []
+        for symbol, result in zip(symbols, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Live fetch failed for {symbol}: {str(result)}")
+                self._add_stat("stock1m", "failed", 1)
+            elif result is not None:
+                deltas.append(result)
+        fetched = time.perf_counter()
+        if not deltas:
+            logger.info(f"Live round: no new bars ({fetched - started:.2f}s fetch)")
+            return
+
+        rows, inserted, updated, latencies = await asyncio.to_thread(
+            self._write_live, conn, deltas, since
+        )
+        written = time.perf_counter()
+        latency = ""
+        if len(latencies):
+            latency = (
+                f", bar close to commit p50 {np.median(latencies):.1f}s "
+                f"max {latencies.max():.1f}s over {len(latencies)} bars"
+            )
+        logger.info(
+            f"Live round: {rows} rows for {len(deltas)}/{len(symbols)} symbols "
+            f"({inserted} inserted, {updated} updated), "
+            f"fetch {fetched - started:.2f}s, write {written - fetched:.2f}s{latency}"
+        )
+
+    async def _live_loop(self, symbols, calendar, interval):
+        logger = logging.getLogger()
+        since = np.datetime64(time.time_ns() // 1000, "us")
+        conn = None
+        polled_day = None
+        try:
+            while self.is_running:
+                now = calendar.now()
+                if calendar.session_at(now, LIVE_SESSION_GRACE) is None:
+                    next_open = calendar.next_open(now)
+                    if polled_day is not None and next_open.normalize() != polled_day:
+                        # Done for the day: vacuum what today's rounds wrote.
+                        polled_day = None
+                        if self.maintenance_mode != "off":
+                            await asyncio.to_thread(self._maintenance)
+                    logger.info(f"Market closed until {next_open}")
+                    await self._sleep_until(calendar, next_open)
+                    continue
+
+                polled_day = now.normalize()
+                try:
+                    if conn is None:
+                        conn = await asyncio.to_thread(self._getconn)
+                    await self._live_round(
+                        conn, symbols, now.strftime("%Y-%m-%d"), since
+                    )
+                except psycopg2.Error as e:
+                    # Watermarks only advance on commit; the next round
+                    # picks the same bars up again on a fresh connection.
+                    logger.error(f"Live round failed: {str(e)}")
+                    if conn is not None:
+                        self.pool.putconn(conn, close=True)
+                        conn = None
+                await asyncio.to_thread(self._export_metrics)
+                await self._sleep_until(
+                    calendar,
+                    calendar.now().ceil(f"{interval}s")
+                    + pd.Timedelta(seconds=LIVE_POLL_DELAY),
+                )
+        finally:
+            if conn is not None:
+                self.pool.putconn(conn)
+
+    def run_live(self, symbols, calendar=None, interval=LIVE_POLL_INTERVAL):
+        """Keep ``symbols``' 1m bars current through every trading session
+        until interrupted; run process_symbols first to backfill."""
+        main_logger = logging.getLogger()
+        calendar = calendar or TradingCalendar()
+        self._load_watermarks(symbols)
+        self._prepare_partitions(symbols)
+        self.live_commits = {}
+        main_logger.info(f"Live mode for {len(symbols)} symbols")
+        try:
+            asyncio.run(self._live_loop(symbols, calendar, interval))
+        finally:
+            summary = self.live_latency.summary()
+            if summary["count"]:
+                main_logger.info(
+                    f"Live mode: {summary['count']} bars committed, mean "
+                    f"{summary['sum'] / summary['count']:.1f}s after close"
+                )
+            self._export_metrics()
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Crawl VN stock OHLCV into Postgres")
+    parser.add_argument(
+        "--load-mode",
+        choices=LOAD_MODES,
+        default=LOAD_MODE,
+        help="how frames are written to the partitioned tables",
+    )
+    parser.add_argument(
+        "--fetch-workers",
+        type=int,
+        default=MAX_WORKERS,
+        help="symbols fetched concurrently",
+    )
+    parser.add_argument(
+        "--source-limit",
+        action="append",
+        default=[],
+        type=parse_source_limit,
+        metavar="SOURCE=RATE[:CONCURRENCY]",
+        help="requests/sec and in-flight cap for a vnstock source",
+    )
+    parser.add_argument(
+        "--writer-workers",
+        type=int,
+        default=WRITER_WORKERS,
+        help="concurrent writers to start with",
+    )
+    parser.add_argument(
+        "--max-writer-workers",
+        type=int,
+        default=MAX_WRITER_WORKERS,
+        help="most concurrent writers the write tuner may use",
+    )
+    parser.add_argument(
+        "--static-writes",
+        action="store_true",
+        help=f"keep {CHUNK_SIZE} rows per write transaction and "
+        "--writer-workers writers instead of tuning them",
+    )
+    parser.add_argument(
+        "--backfill-window",
+        type=float,
+        default=BACKFILL_WINDOWS["stock1m"].days,
+        help="days of 1m history per backfill request (0 fetches in one go)",
+    )
+    parser.add_argument(
+        "--derive",
+        choices=DERIVE_MODES,
+        help="build 1h/1d bars from 1m locally: 'write' replaces their API "
+        "calls, 'verify' fetches both and reports differences",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=WRITE_QUEUE_SIZE,
+        help="fetched frames buffered ahead of the writers",
+    )
+    parser.add_argument(
+        "--symbols",
+        type=lambda value: [s.strip().upper() for s in value.split(",") if s.strip()],
+        default=VN100,
+        help="comma-separated symbols to crawl (default VN100)",
+    )
+    parser.add_argument(
+        "--queue",
+        choices=QUEUE_MODES,
+        help="'enqueue' the symbols into the crawl_jobs table, or 'work' "
+        "claimed symbols until the table is drained (any number of workers)",
+    )
+    parser.add_argument("--claim-size", type=int, help="symbols claimed at a time")
+    parser.add_argument(
+        "--worker-id",
+        help="stable name of this queue worker, required with --queue work and "
+        "unique per running worker; a restarted worker resumes its jobs and "
+        "progress journal under it",
+    )
+    parser.add_argument(
+        "--live",
+        action="store_true",
+        help="catch up, then stay running and upsert new 1m bars during "
+        "trading sessions",
+    )
+    parser.add_argument(
+        "--live-interval",
+        type=int,
+        default=LIVE_POLL_INTERVAL,
+        help="seconds between live polling rounds",
+    )
+    parser.add_argument(
+        "--repair",
+        action="store_true",
+        help="instead of crawling forward, refetch only the trading days "
+        "missing from what is already stored",
+    )
+    parser.add_argument(
+        "--repair-since",
+        type=pd.Timestamp,
+        metavar="YYYY-MM-DD",
+        help="only look for gaps from this date on",
+    )
+    parser.add_argument(
+        "--compact",
+        nargs="?",
+        const="M",
+        choices=COMPACT_UNITS,
+        help="instead of crawling, merge stock1m's closed daily partitions "
+        "into one per month (M, the default) or year (Y)",
+    )
+    parser.add_argument(
+        "--compact-before",
+        type=pd.Timestamp,
+        metavar="YYYY-MM-DD",
+        help=f"only compact periods ending by this date "
+        f"(default {COMPACT_MIN_AGE.days} days ago)",
+    )
+    parser.add_argument(
+        "--holiday",
+        action="append",
+        default=[],
+        metavar="YYYY-MM-DD",
+        help="extra market holiday for the trading calendar",
+    )
+    parser.add_argument("--db-host", help="Postgres host (default localhost)")
+    parser.add_argument(
+        "--cache-dir",
+        help="keep raw upstream bars here (Arrow IPC) and serve closed days "
+        "from it instead of refetching",
+    )
+    parser.add_argument(
+        "--cache-max-gb",
+        type=float,
+        default=CACHE_MAX_BYTES / 1024**3,
+        help="evict least recently used cache files beyond this size",
+    )
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="load the database from --cache-dir only, without calling upstream",
+    )
+    parser.add_argument(
+        "--maintenance",
+        choices=MAINTENANCE_MODES,
+        default="after",
+        help="VACUUM (ANALYZE) written partitions after the run, or also "
+        "during it once no symbol will write to them again",
+    )
+    parser.add_argument(
+        "--maintenance-workers",
+        type=int,
+        default=MAINTENANCE_WORKERS,
+        help="dedicated connections used for maintenance",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="write Prometheus metrics to this file (textfile collector format)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve Prometheus metrics on localhost at this port",
+    )
+    parser.add_argument(
+        "--profile-symbol",
+        help="cProfile the write path for this symbol into logs/",
+    )
+    args = parser.parse_args()
+    if args.queue == "work" and not args.worker_id:
+        parser.error("--queue work needs a --worker-id")
+
+    db_config = dict(DB_CONFIG)
+    if args.db_host:
+        db_config["host"] = args.db_host
+    worker_id = args.worker_id or socket.gethostname()
+
+    if args.queue == "enqueue":
+        jobs = JobQueue(db_config, worker_id)
+        try:
+            jobs.create()
+            queued = jobs.enqueue(args.symbols)
+            logging.getLogger().info(
+                f"Queued {queued} symbols; job queue: {jobs.counts()}"
+            )
+        finally:
+            jobs.close()
+        return
+
     processor = None
     try:
-        processor = StockDataProcessor()
-        symbols = VN100
-        processor.process_symbols(symbols)
-        processor._maintenance()
+        processor = StockDataProcessor(
+            load_mode=args.load_mode,
+            fetch_workers=args.fetch_workers,
+            writer_workers=args.writer_workers,
+            max_writer_workers=args.max_writer_workers,
+            adaptive_writes=not args.static_writes,
+            queue_size=args.queue_size,
+            source_limits=dict(args.source_limit),
+            backfill_windows={
+                "stock1m": (
+                    pd.Timedelta(days=args.backfill_window)
+                    if args.backfill_window
+                    else None
+                )
+            },
+            derive=args.derive,
+            metrics_file=args.metrics_file,
+            profile_symbol=args.profile_symbol,
+            maintenance=args.maintenance,
+            maintenance_workers=args.maintenance_workers,
+            db_config=db_config,
+            worker_id=worker_id if args.queue == "work" else None,
+            cache_dir=args.cache_dir,
+            cache_max_bytes=int(args.cache_max_gb * 1024**3),
+            replay=args.replay,
+        )
+        if args.metrics_port:
+            processor.metrics.serve(args.metrics_port)
+        calendar = TradingCalendar(MARKET_HOLIDAYS + tuple(args.holiday))
+        if args.queue == "work":
+            jobs = JobQueue(db_config, worker_id)
+            jobs.create()
+            processor.work_queue(jobs, args.claim_size)
+        elif args.repair:
+            processor.repair_gaps(args.symbols, calendar, args.repair_since)
+        elif args.compact:
+            processor.compact_partitions(unit=args.compact, before=args.compact_before)
+        else:
+            processor.process_symbols(args.symbols, skip_completed=not args.live)
+        if args.live:
+            processor.run_live(args.symbols, calendar, args.live_interval)
+        if args.maintenance != "off":
+            processor._maintenance()
 
     except Exception as e:
         logging.getLogger().error(f"Main error: {str(e)}")
     finally:
+        if processor:
+            processor.fetcher.close()
         if processor and hasattr(processor, "pool"):
             try:
                 processor.pool.closeall()
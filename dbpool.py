@@ -0,0 +1,159 @@
+"""Database settings and a thread-safe Postgres pool for crawl.py and reader.py.
+
+Unlike psycopg2's pools, getconn() blocks while every connection is checked
+out instead of raising, so the pool can be sized to the number of threads
+sharing it. Connections are opened up front, handed out most recently used
+first, and pinged before reuse once they have sat idle for a while, so a
+connection the server or a firewall dropped is replaced rather than failing
+the next statement. Each connection remembers the statements prepared on
+it, which live as long as its session.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+DB_CONFIG = {
+    "dbname": "stockgpt-trading",
+    "user": "admin",
+    "password": "dev",
+    # "user": "onstocks",
+    # "password": ".wHD0_Q]Xf')aq(b",
+    "host": "localhost",
+}
+
+MIN_CONNECTIONS = 1
+MAX_CONNECTIONS = 20
+# Idle seconds after which a connection is pinged before it is handed out.
+POOL_CHECK_INTERVAL = 30
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Connection that tracks its server-side prepared statements."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.released = time.monotonic()
+
+    def prepare(self, name, statement, types=()):
+        """PREPARE ``statement`` as ``name`` once per session. Prepared
+        statements are not transactional, so one outlives a rollback."""
+        if name in self.prepared:
+            return name
+        params = f" ({', '.join(types)})" if types else ""
+        with self.cursor() as cur:
+            cur.execute(f"PREPARE {name}{params} AS {statement}")
+        self.prepared.add(name)
+        return name
+
+
+class ConnectionPool:
+    def __init__(
+        self, db_config, size, prewarm=None, check_interval=POOL_CHECK_INTERVAL
+    ):
+        self.db_config = db_config
+        self.size = size
+        self.check_interval = check_interval
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.idle = []
+        self.used = set()
+        self.closed = False
+        self.stats = {"opened": 0, "replaced": 0}
+        for _ in range(size if prewarm is None else min(prewarm, size)):
+            self.idle.append(self._open())
+
+    def _open(self):
+        conn = psycopg2.connect(connection_factory=PooledConnection, **self.db_config)
+        with self.lock:
+            self.stats["opened"] += 1
+        return conn
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.released < self.check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            logging.getLogger().warning(f"Replacing stale pooled connection: {e}")
+            conn.close()
+            return False
+
+    def getconn(self, timeout=None):
+        """A connection, waiting up to ``timeout`` seconds (None: forever)
+        for one to be returned if all are in use."""
+        if self.closed:
+            raise PoolError("connection pool is closed")
+        if not self.slots.acquire(timeout=timeout):
+            raise PoolError(f"no connection free after {timeout}s")
+        try:
+            with self.lock:
+                conn = self.idle.pop() if self.idle else None
+            if conn is not None and not self._healthy(conn):
+                with self.lock:
+                    self.stats["replaced"] += 1
+                conn = None
+            if conn is None:
+                conn = self._open()
+        except Exception:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.used.add(conn)
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Return ``conn``, rolled back if it was left in a transaction;
+        with ``close`` (or if it is broken), it is closed instead."""
+        if not conn.closed and not close:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
+        with self.lock:
+            if conn not in self.used:
+                raise PoolError("connection not checked out of this pool")
+            self.used.discard(conn)
+            close = close or self.closed
+            if not close and not conn.closed:
+                conn.released = time.monotonic()
+                self.idle.append(conn)
+        if close and not conn.closed:
+            conn.close()
+        self.slots.release()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def in_use(self):
+        with self.lock:
+            return len(self.used)
+
+    def closeall(self):
+        with self.lock:
+            self.closed = True
+            conns = self.idle + list(self.used)
+            self.idle = []
+        for conn in conns:
+            if not conn.closed:
+                conn.close()
@@ -0,0 +1,154 @@
+"""Asyncio fetch engine for the vnstock sources.
+
+vnstock's client is blocking, so calls run on a dedicated thread pool; the
+engine decides *when* they run: each source gets a token bucket (requests per
+second), a concurrency cap and retries with jittered exponential backoff.
+Any object with vnstock's ``stock(symbol=..., source=...)`` interface can be
+used as the client, which is how the benchmarks plug in a fake source.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Requests per second, burst size and in-flight cap for each upstream source.
+SOURCE_LIMITS = {
+    "VCI": {"rate": 5.0, "burst": 5, "concurrency": 4},
+    "TCBS": {"rate": 2.0, "burst": 2, "concurrency": 2},
+}
+DEFAULT_SOURCE_LIMIT = {"rate": 2.0, "burst": 2, "concurrency": 2}
+
+FETCH_RETRIES = 4
+FETCH_BACKOFF = 1.0
+FETCH_MAX_BACKOFF = 30.0
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class FetchEngine:
+    """Rate-limited async wrapper around vnstock quote and company calls.
+
+    The buckets and semaphores are created lazily for the running event
+    loop, and again if a later ``asyncio.run`` brings a new one (a job-queue
+    worker crawls one batch per run); asyncio primitives can't cross loops.
+    """
+
+    def __init__(
+        self,
+        client,
+        limits=None,
+        retries=FETCH_RETRIES,
+        backoff=FETCH_BACKOFF,
+        max_backoff=FETCH_MAX_BACKOFF,
+    ):
+        self.client = client
+        self.limits = dict(SOURCE_LIMITS, **(limits or {}))
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.executor = ThreadPoolExecutor(
+            max_workers=sum(limit["concurrency"] for limit in self.limits.values()),
+            thread_name_prefix="vnstock",
+        )
+        self.loop = None
+        self.buckets = {}
+        self.semaphores = {}
+        self.stats = {"calls": 0, "retries": 0, "errors": 0}
+
+    def _limit(self, source):
+        return self.limits.get(source, DEFAULT_SOURCE_LIMIT)
+
+    def _guards(self, source):
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop = loop
+            self.buckets = {}
+            self.semaphores = {}
+        if source not in self.buckets:
+            limit = self._limit(source)
+            self.buckets[source] = TokenBucket(limit["rate"], limit["burst"])
+            self.semaphores[source] = asyncio.Semaphore(limit["concurrency"])
+        return self.buckets[source], self.semaphores[source]
+
+    async def call(self, source, fn, *args, **kwargs):
+        """Run a blocking upstream call under ``source``'s limits, retrying
+        failures with full-jitter exponential backoff."""
+        bucket, semaphore = self._guards(source)
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            async with semaphore:
+                await bucket.acquire()
+                self.stats["calls"] += 1
+                try:
+                    return await loop.run_in_executor(
+                        self.executor, lambda: fn(*args, **kwargs)
+                    )
+                except Exception as e:
+                    if attempt >= self.retries:
+                        self.stats["errors"] += 1
+                        raise
+                    error = e
+            attempt += 1
+            self.stats["retries"] += 1
+            delay = random.uniform(
+                0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+            )
+            logging.getLogger().warning(
+                f"{source} call failed ({str(error)}), "
+                f"retry {attempt}/{self.retries} in {delay:.1f}s"
+            )
+            await asyncio.sleep(delay)
+
+    async def history(self, symbol, start, end, interval, source="VCI"):
+        def fetch():
+            stock = self.client.stock(symbol=symbol, source=source)
+            return stock.quote.history(start=start, end=end, interval=interval)
+
+        return await self.call(source, fetch)
+
+    async def overview(self, symbol, source="TCBS"):
+        def fetch():
+            stock = self.client.stock(symbol=symbol, source=source)
+            return stock.company.overview()
+
+        return await self.call(source, fetch)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_source_limit(value):
+    """Parse ``SOURCE=RATE[:CONCURRENCY]`` from the command line."""
+    source, _, spec = value.partition("=")
+    rate, _, concurrency = spec.partition(":")
+    if not source or not rate:
+        raise ValueError(f"Expected SOURCE=RATE[:CONCURRENCY], got {value!r}")
+    limit = dict(SOURCE_LIMITS.get(source, DEFAULT_SOURCE_LIMIT))
+    limit["rate"] = float(rate)
+    limit["burst"] = max(1, int(float(rate)))
+    if concurrency:
+        limit["concurrency"] = int(concurrency)
+    return source, limit
@@ -0,0 +1,251 @@
+"""Job queue that spreads a crawl over worker processes on any number of hosts.
+
+Symbols live in the crawl_jobs table. Workers claim batches with FOR UPDATE
+SKIP LOCKED, so they never wait on each other, and hold them under a lease
+kept alive by a heartbeat thread; a lease that runs out (crashed or stuck
+worker) makes the symbol claimable again, up to JOB_MAX_ATTEMPTS claims.
+Each queue uses its own autocommit connection, outside the ingestion pool.
+"""
+
+import logging
+import threading
+from datetime import timedelta
+
+import psycopg2
+
+JOB_LEASE = timedelta(minutes=5)
+JOB_HEARTBEAT_INTERVAL = 30
+JOB_MAX_ATTEMPTS = 3
+# A worker whose last heartbeat is older than this many intervals is gone.
+JOB_STALE_HEARTBEATS = 2
+
+
+class JobQueue:
+    """Symbols to crawl, claimed and leased through the crawl_jobs table."""
+
+    TABLE = "crawl_jobs"
+
+    def __init__(
+        self,
+        db_config,
+        worker,
+        lease=JOB_LEASE,
+        heartbeat_interval=JOB_HEARTBEAT_INTERVAL,
+        max_attempts=JOB_MAX_ATTEMPTS,
+    ):
+        self.db_config = db_config
+        self.worker = worker
+        self.lease = lease
+        self.heartbeat_interval = heartbeat_interval
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.conn = None
+        self.held = set()
+        self.stop_heartbeat = threading.Event()
+        self.heartbeat_thread = None
+
+    def _execute(self, sql, params=None):
+        with self.lock:
+            if self.conn is None or self.conn.closed:
+                self.conn = psycopg2.connect(**self.db_config)
+                self.conn.autocommit = True
+            with self.conn.cursor() as cur:
+                cur.execute(sql, params)
+                return cur.fetchall() if cur.description else cur.rowcount
+
+    def create(self):
+        # Workers starting together would race on the DDL; one statement
+        # string runs as one transaction, so the lock covers both.
+        self._execute(
+            f"""
+            SELECT pg_advisory_xact_lock(hashtext('{self.TABLE}'));
+            CREATE TABLE IF NOT EXISTS {self.TABLE} (
+                symbol varchar(12) PRIMARY KEY,
+                status varchar(10) NOT NULL DEFAULT 'pending',
+                attempts int NOT NULL DEFAULT 0,
+                worker text,
+                lease_until timestamptz,
+                heartbeat_at timestamptz,
+                updated_at timestamptz NOT NULL DEFAULT now()
+            );
+            CREATE INDEX IF NOT EXISTS {self.TABLE}_claim_idx
+                ON {self.TABLE} (status, lease_until);
+            """
+        )
+
+    def enqueue(self, symbols):
+        """Queue ``symbols`` for a new pass; jobs being worked are left
+        alone. Returns how many were (re)queued."""
+        return self._execute(
+            f"""
+            INSERT INTO {self.TABLE} (symbol)
+            SELECT unnest(%s::varchar[])
+            ON CONFLICT (symbol) DO UPDATE SET
+                status = 'pending',
+                attempts = 0,
+                worker = NULL,
+                lease_until = NULL,
+                updated_at = now()
+            WHERE {self.TABLE}.status <> 'running'
+            """,
+            (list(symbols),),
+        )
+
+    def claim(self, limit):
+        # Jobs whose lease ran out after their last allowed attempt are failed.
+        self._execute(
+            f"""
+            UPDATE {self.TABLE}
+            SET status = 'failed', worker = NULL, updated_at = now()
+            WHERE status = 'running'
+            AND lease_until < now()
+            AND attempts >= %s
+            """,
+            (self.max_attempts,),
+        )
+        rows = self._execute(
+            f"""
+            WITH claimable AS (
+                SELECT symbol FROM {self.TABLE}
+                WHERE attempts < %(max_attempts)s
+                AND (
+                    status = 'pending'
+                    OR (status = 'running' AND lease_until < now())
+                    -- Held under this worker's id by a run that has died.
+                    OR (
+                        status = 'running'
+                        AND worker = %(worker)s
+                        AND heartbeat_at < now() - %(stale)s
+                    )
+                )
+                ORDER BY updated_at, symbol
+                LIMIT %(limit)s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE {self.TABLE} j
+            SET
+                status = 'running',
+                worker = %(worker)s,
+                attempts = j.attempts + 1,
+                lease_until = now() + %(lease)s,
+                heartbeat_at = now(),
+                updated_at = now()
+            FROM claimable c
+            WHERE j.symbol = c.symbol
+            RETURNING j.symbol
+            """,
+            {
+                "max_attempts": self.max_attempts,
+                "limit": limit,
+                "worker": self.worker,
+                "lease": self.lease,
+                "stale": self._stale(),
+            },
+        )
+        symbols = sorted(symbol for (symbol,) in rows)
+        self.held.update(symbols)
+        return symbols
+
+    def heartbeat(self):
+        held = list(self.held)
+        if not held:
+            return
+        self._execute(
+            f"""
+            UPDATE {self.TABLE}
+            SET lease_until = now() + %s, heartbeat_at = now()
+            WHERE symbol = ANY(%s) AND worker = %s AND status = 'running'
+            """,
+            (self.lease, held, self.worker),
+        )
+
+    def _heartbeat_loop(self):
+        while not self.stop_heartbeat.wait(self.heartbeat_interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logging.getLogger().error(f"Job heartbeat failed: {str(e)}")
+
+    def _stale(self):
+        return timedelta(seconds=self.heartbeat_interval * JOB_STALE_HEARTBEATS)
+
+    def start(self):
+        """Start heartbeating; refuses if a live worker holds jobs under
+        this worker's id."""
+        (live,) = self._execute(
+            f"""
+            SELECT count(*) FROM {self.TABLE}
+            WHERE worker = %s AND status = 'running'
+            AND heartbeat_at >= now() - %s
+            """,
+            (self.worker, self._stale()),
+        )[0]
+        if live:
+            raise RuntimeError(
+                f"Worker {self.worker} is already running ({live} jobs held)"
+            )
+        self.stop_heartbeat.clear()
+        self.heartbeat_thread = threading.Thread(
+            target=self._heartbeat_loop, name="job-heartbeat", daemon=True
+        )
+        self.heartbeat_thread.start()
+
+    def complete(self, symbols, completed):
+        """Mark claimed ``symbols`` done if ``completed``, else requeue them
+        (or fail them once out of attempts)."""
+        symbols = list(symbols)
+        done = [symbol for symbol in symbols if symbol in completed]
+        retry = [symbol for symbol in symbols if symbol not in completed]
+        self._execute(
+            f"""
+            UPDATE {self.TABLE}
+            SET
+                status = CASE
+                    WHEN symbol = ANY(%(done)s) THEN 'done'
+                    WHEN attempts >= %(max_attempts)s THEN 'failed'
+                    ELSE 'pending'
+                END,
+                worker = NULL,
+                lease_until = NULL,
+                updated_at = now()
+            WHERE symbol = ANY(%(symbols)s)
+            AND worker = %(worker)s
+            AND status = 'running'
+            """,
+            {
+                "done": done,
+                "symbols": symbols,
+                "max_attempts": self.max_attempts,
+                "worker": self.worker,
+            },
+        )
+        self.held.difference_update(symbols)
+        return len(done), len(retry)
+
+    def counts(self):
+        return dict(
+            self._execute(f"SELECT status, count(*) FROM {self.TABLE} GROUP BY status")
+        )
+
+    def close(self):
+        """Stop heartbeating and hand back anything still held."""
+        self.stop_heartbeat.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+        try:
+            if self.held:
+                self._execute(
+                    f"""
+                    UPDATE {self.TABLE}
+                    SET status = 'pending', worker = NULL, lease_until = NULL,
+                        attempts = attempts - 1, updated_at = now()
+                    WHERE symbol = ANY(%s) AND worker = %s AND status = 'running'
+                    """,
+                    (list(self.held), self.worker),
+                )
+                self.held.clear()
+        finally:
+            with self.lock:
+                if self.conn is not None:
+                    self.conn.close()
+                    self.conn = None
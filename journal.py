@@ -0,0 +1,104 @@
+"""Append-only journal of committed crawl progress, for resuming a run.
+
+``M<TAB>symbol<TAB>table<TAB>time`` marks the last bar committed for a
+(symbol, table) stream and ``D<TAB>symbol`` a finished symbol. Lines are
+flushed as they are written and fsynced at most every JOURNAL_SYNC_INTERVAL
+seconds, so a crash can only lose recent marks, and those bars are just
+written again. Loading replays the file and rewrites it compacted.
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+# Journal lines are flushed as written but fsynced at most this often.
+JOURNAL_SYNC_INTERVAL = 1.0
+
+
+class ProgressJournal:
+    """Committed progress per (symbol, table) stream, and finished symbols."""
+
+    def __init__(self, path, sync_interval=JOURNAL_SYNC_INTERVAL):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.marks = {}
+        self.done = set()
+        self.file = None
+        self.synced = 0.0
+
+    def load(self):
+        marks = {}
+        done = set()
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    fields = line.rstrip("\n").split("\t")
+                    if fields[0] == "D" and len(fields) == 2:
+                        done.add(fields[1])
+                    elif fields[0] == "M" and len(fields) == 4:
+                        try:
+                            at = np.datetime64(fields[3], "us")
+                        except ValueError:
+                            continue  # torn final line
+                        key = (fields[1], fields[2])
+                        if key not in marks or at > marks[key]:
+                            marks[key] = at
+        except FileNotFoundError:
+            pass
+        marks = {key: at for key, at in marks.items() if key[0] not in done}
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.writelines(f"D\t{symbol}\n" for symbol in sorted(done))
+            f.writelines(
+                f"M\t{symbol}\t{table_name}\t{at}\n"
+                for (symbol, table_name), at in sorted(marks.items())
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+        with self.lock:
+            self.marks = marks
+            self.done = done
+            self.file = open(self.path, "a")
+            self.synced = time.monotonic()
+
+    def _append(self, line):
+        # Caller holds self.lock.
+        self.file.write(line)
+        self.file.flush()
+        now = time.monotonic()
+        if now - self.synced >= self.sync_interval:
+            os.fsync(self.file.fileno())
+            self.synced = now
+
+    def get(self, symbol, table_name):
+        return self.marks.get((symbol, table_name))
+
+    def mark(self, symbol, table_name, at):
+        at = np.datetime64(at, "us")
+        with self.lock:
+            current = self.marks.get((symbol, table_name))
+            if current is None or at > current:
+                self.marks[(symbol, table_name)] = at
+            self._append(f"M\t{symbol}\t{table_name}\t{at}\n")
+
+    def finish(self, symbol):
+        with self.lock:
+            self.done.add(symbol)
+            for key in [key for key in self.marks if key[0] == symbol]:
+                del self.marks[key]
+            self._append(f"D\t{symbol}\n")
+
+    def close(self):
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
@@ -0,0 +1,292 @@
+"""In-process metrics for crawl.py, exported in Prometheus text format.
+
+Counters and histograms keep one cell per thread, so the hot path only ever
+touches memory owned by the calling thread and never takes a lock; readers
+sum the cells. Callback gauges are evaluated when the metrics are rendered.
+"""
+
+import bisect
+import cProfile
+import logging
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, help):
+        self.registry = registry
+        self.name = name
+        self.help = help
+
+    def _cells(self):
+        """Per-thread {label key: cell} dicts for this metric."""
+        return self.registry._cells(self.name)
+
+    def _local(self):
+        return self.registry._local_cells(self.name)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        cells = self._local()
+        key = _label_key(labels)
+        cells[key] = cells.get(key, 0) + amount
+
+    def values(self):
+        totals = {}
+        for cells in self._cells():
+            for key, value in list(cells.items()):
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def value(self, **labels):
+        return self.values().get(_label_key(labels), 0)
+
+    def render(self):
+        return [
+            f"{self.name}{_format_labels(key)} {value}"
+            for key, value in sorted(self.values().items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help, buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        cells = self._local()
+        key = _label_key(labels)
+        cell = cells.get(key)
+        if cell is None:
+            # [count per bucket..., +Inf count, sum]
+            cell = cells[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def values(self):
+        totals = {}
+        for cells in self._cells():
+            for key, cell in list(cells.items()):
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = list(cell)
+                else:
+                    for i, value in enumerate(cell):
+                        total[i] += value
+        return totals
+
+    def summary(self, **labels):
+        cell = self.values().get(_label_key(labels))
+        if cell is None:
+            return {"count": 0, "sum": 0.0}
+        return {"count": sum(cell[:-1]), "sum": cell[-1]}
+
+    def render(self):
+        lines = []
+        for key, cell in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), cell[:-1]):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(key, [('le', bound)])} "
+                    f"{cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_format_labels(key)} {cell[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Gauge read from ``fn()``: a number, or a list of (labels, value)."""
+
+    kind = "gauge"
+
+    def __init__(self, registry, name, help, fn):
+        super().__init__(registry, name, help)
+        self.fn = fn
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if isinstance(value, list):
+            return [
+                f"{self.name}{_format_labels(_label_key(labels))} {sample}"
+                for labels, sample in value
+            ]
+        return [f"{self.name} {value}"]
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.thread_cells = []
+        self.local = threading.local()
+
+    def _local_cells(self, name):
+        cells = getattr(self.local, "cells", None)
+        if cells is None:
+            cells = self.local.cells = {}
+            with self.lock:
+                self.thread_cells.append(cells)
+        metric_cells = cells.get(name)
+        if metric_cells is None:
+            metric_cells = cells[name] = {}
+        return metric_cells
+
+    def _cells(self, name):
+        with self.lock:
+            thread_cells = list(self.thread_cells)
+        return [cells[name] for cells in thread_cells if name in cells]
+
+    def _register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help):
+        return self._register(Counter(self, name, help))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self, name, help, buckets))
+
+    def gauge(self, name, help, fn):
+        return self._register(Gauge(self, name, help, fn))
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Write for node_exporter's textfile collector (atomic rename)."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve /metrics from a daemon thread; returns the server."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(
+            target=server.serve_forever, name="metrics-http", daemon=True
+        ).start()
+        logging.getLogger().info(f"Serving metrics on http://{host}:{port}/metrics")
+        return server
+
+
+class SymbolProfiler:
+    """cProfile the work done for one symbol, across whichever threads do it."""
+
+    def __init__(self, symbol, path):
+        self.symbol = symbol
+        self.path = path
+        self.lock = threading.Lock()
+        self.active = threading.Lock()
+        self.profiles = []
+
+    @contextmanager
+    def profile(self, symbol):
+        if symbol != self.symbol:
+            yield
+            return
+        # One profiler at a time: from 3.12 cProfile is process-wide.
+        with self.active:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                with self.lock:
+                    self.profiles.append(profile)
+
+    def dump(self):
+        with self.lock:
+            profiles = list(self.profiles)
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(self.path)
+        return self.path
@@ -0,0 +1,257 @@
+"""Local columnar cache of raw upstream bars, for replay and backfill.
+
+Frames returned by quote.history are stored as uncompressed Arrow IPC files,
+one per interval/symbol/period (a day of 1m bars, a month of 1h, a year of
+1d), and memory-mapped when read back. Each file records the days it covers;
+only days that had already closed when they were fetched are stored, empty
+ones included, so a cached day is never requested upstream again and an open
+month or year is extended as its days close. A file's covered days are a list
+of ranges, so a write elsewhere in its period keeps what is already there. The directory is capped in size
+and the least recently used files are evicted first.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # only needed when a cache directory is configured
+    pa = None
+
+CACHE_MAX_BYTES = 20 * 1024**3
+# A full cache is trimmed to this fraction of its cap, so it doesn't sort its
+# index again on every write.
+CACHE_EVICT_TO = 0.9
+# File granularity per interval.
+CACHE_PERIODS = {"1m": "D", "1h": "M", "1d": "Y"}
+COLUMNS = ("time", "open", "high", "low", "close", "volume")
+
+
+class RawCache:
+    def __init__(self, root, max_bytes=CACHE_MAX_BYTES):
+        if pa is None:
+            raise RuntimeError("The raw data cache needs pyarrow (pip install pyarrow)")
+        self.root = root
+        self.max_bytes = max_bytes
+        self.schema = pa.schema(
+            [("time", pa.timestamp("us"))]
+            + [(column, pa.float64()) for column in COLUMNS[1:]]
+        )
+        self.lock = threading.Lock()
+        # path -> [bytes, last used]
+        self.files = {}
+        self.size = 0
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._scan()
+
+    def _scan(self):
+        os.makedirs(self.root, exist_ok=True)
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                if name.endswith(".tmp"):
+                    os.remove(path)
+                elif name.endswith(".arrow"):
+                    stat = os.stat(path)
+                    self.files[path] = [stat.st_size, stat.st_mtime]
+                    self.size += stat.st_size
+
+    def _path(self, symbol, interval, period):
+        return os.path.join(self.root, interval, symbol, f"{period}.arrow")
+
+    def _load(self, path):
+        with self.lock:
+            entry = self.files.get(path)
+            if entry is None:
+                return None
+            entry[1] = time.time()
+        try:
+            # The table's buffers point into the mapping, which lives as long
+            # as they do.
+            table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+            os.utime(path)
+        except (OSError, pa.ArrowInvalid) as e:
+            logging.getLogger().warning(f"Dropping unreadable cache file {path}: {e}")
+            self._remove(path)
+            return None
+        return table
+
+    def _remove(self, path):
+        with self.lock:
+            entry = self.files.pop(path, None)
+            if entry is not None:
+                self.size -= entry[0]
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _coverage(table):
+        """Sorted (first, last) day ranges a cached file covers."""
+        metadata = table.schema.metadata
+        if b"coverage" not in metadata:
+            # Written before coverage was a list of ranges.
+            return [
+                (
+                    pd.Timestamp(metadata[b"first"].decode()),
+                    pd.Timestamp(metadata[b"last"].decode()),
+                )
+            ]
+        return [
+            tuple(pd.Timestamp(day) for day in span.split(":"))
+            for span in metadata[b"coverage"].decode().split(",")
+        ]
+
+    @staticmethod
+    def _merge(ranges):
+        day = pd.Timedelta(days=1)
+        merged = []
+        for first, last in sorted(ranges):
+            if merged and first <= merged[-1][1] + day:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+            else:
+                merged.append((first, last))
+        return merged
+
+    def read(self, symbol, interval, start, end):
+        """Cached bars for the days [start, end], as a quote.history-shaped
+        frame (or None), and the (start, end) day ranges not cached."""
+        day = pd.Timedelta(days=1)
+        tables = []
+        missing = []
+        misses = 0
+
+        def gap(lo, hi):
+            if lo > hi:
+                return
+            if missing and missing[-1][1] + day >= lo:
+                missing[-1] = (missing[-1][0], hi)
+            else:
+                missing.append((lo, hi))
+
+        for period in pd.period_range(start, end, freq=CACHE_PERIODS[interval]):
+            lo = max(period.start_time, start)
+            hi = min(period.end_time.normalize(), end)
+            table = self._load(self._path(symbol, interval, period))
+            if table is None:
+                misses += 1
+                gap(lo, hi)
+                continue
+            uncovered = []
+            for first, last in self._coverage(table):
+                if first > lo:
+                    uncovered.append((lo, min(hi, first - day)))
+                lo = max(lo, last + day)
+            uncovered.append((lo, hi))
+            uncovered = [(a, b) for a, b in uncovered if a <= b]
+            if uncovered:
+                misses += 1
+            for a, b in uncovered:
+                gap(a, b)
+            tables.append(table)
+        with self.lock:
+            self.stats["hits"] += len(tables)
+            self.stats["misses"] += misses
+
+        rows = sum(table.num_rows for table in tables)
+        if not rows:
+            return None, missing
+        frame = pa.concat_tables(tables).to_pandas()
+        in_range = (frame["time"] >= start) & (
+            frame["time"] < end + pd.Timedelta(days=1)
+        )
+        return frame[in_range].reset_index(drop=True), missing
+
+    def write(self, symbol, interval, frame, start, end, closed_before):
+        """Store the days [start, end] before ``closed_before`` from
+        ``frame``, as quote.history returned it for that range (None or
+        empty means no bars), merged with the days already cached."""
+        day = pd.Timedelta(days=1)
+        if frame is None or not len(frame):
+            frame = pd.DataFrame({column: [] for column in COLUMNS})
+        frame = frame[list(COLUMNS)].assign(
+            time=pd.to_datetime(frame["time"]).astype("datetime64[us]")
+        )
+        frame = frame.sort_values("time", kind="stable")
+        times = frame["time"].to_numpy()
+
+        for period in pd.period_range(start, end, freq=CACHE_PERIODS[interval]):
+            first = max(period.start_time, start)
+            last = min(period.end_time.normalize(), end, closed_before - day)
+            if last < first:
+                break
+            lo, hi = times.searchsorted(
+                [first.to_datetime64(), (last + day).to_datetime64()]
+            )
+            rows = pa.Table.from_pandas(
+                frame.iloc[lo:hi], schema=self.schema, preserve_index=False
+            )
+            path = self._path(symbol, interval, period)
+            coverage = [(first, last)]
+            cached = self._load(path)
+            if cached is not None:
+                # Keep the cached days outside [first, last].
+                cached_times = cached.column("time").to_numpy()
+                outside = (cached_times < first.to_datetime64()) | (
+                    cached_times >= (last + day).to_datetime64()
+                )
+                rows = (
+                    pa.concat_tables([cached.filter(outside), rows])
+                    .sort_by("time")
+                    .cast(self.schema)
+                )
+                coverage += self._coverage(cached)
+            self._store(path, rows, self._merge(coverage))
+
+    def _store(self, path, table, coverage):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            schema = self.schema.with_metadata(
+                {
+                    "coverage": ",".join(
+                        f"{first:%Y-%m-%d}:{last:%Y-%m-%d}" for first, last in coverage
+                    )
+                }
+            )
+            with pa.ipc.new_file(sink, schema) as writer:
+                writer.write_table(table.cast(schema))
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self.lock:
+            previous = self.files.get(path)
+            if previous is not None:
+                self.size -= previous[0]
+            self.files[path] = [size, time.time()]
+            self.size += size
+            self.stats["writes"] += 1
+            if self.size <= self.max_bytes:
+                return
+            victims = sorted(self.files, key=lambda victim: self.files[victim][1])
+        for victim in victims:
+            if self.size <= self.max_bytes * CACHE_EVICT_TO:
+                break
+            self._remove(victim)
+            with self.lock:
+                self.stats["evictions"] += 1
+
+    def earliest(self, symbol):
+        """Start of the oldest period cached for ``symbol``, or None."""
+        starts = []
+        for interval, freq in CACHE_PERIODS.items():
+            try:
+                names = os.listdir(os.path.join(self.root, interval, symbol))
+            except FileNotFoundError:
+                continue
+            starts.extend(
+                pd.Period(name[: -len(".arrow")], freq=freq).start_time
+                for name in names
+                if name.endswith(".arrow")
+            )
+        return min(starts) if starts else None
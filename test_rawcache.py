@@ -0,0 +1,53 @@
+import pandas as pd
+
+from rawcache import RawCache
+
+CLOSED = pd.Timestamp("2025-01-01")
+
+
+def daily_bars(start, end):
+    times = pd.bdate_range(start, end)
+    return pd.DataFrame(
+        {
+            "time": times,
+            "open": 1.0,
+            "high": 1.0,
+            "low": 1.0,
+            "close": 1.0,
+            "volume": 100.0,
+        }
+    )
+
+
+def cache_days(cache, start, end):
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    cache.write("AAA", "1d", daily_bars(start, end), start, end, CLOSED)
+
+
+def test_write_apart_from_cached_days_keeps_them(tmp_path):
+    cache = RawCache(str(tmp_path))
+    cache_days(cache, "2024-03-01", "2024-03-31")
+    cache_days(cache, "2024-01-01", "2024-01-31")
+
+    frame, missing = cache.read(
+        "AAA", "1d", pd.Timestamp("2024-01-01"), pd.Timestamp("2024-03-31")
+    )
+
+    expected = daily_bars("2024-01-01", "2024-01-31")["time"].tolist()
+    expected += daily_bars("2024-03-01", "2024-03-31")["time"].tolist()
+    assert frame["time"].tolist() == expected
+    assert missing == [(pd.Timestamp("2024-02-01"), pd.Timestamp("2024-02-29"))]
+
+
+def test_filling_the_hole_merges_coverage(tmp_path):
+    cache = RawCache(str(tmp_path))
+    cache_days(cache, "2024-03-01", "2024-03-31")
+    cache_days(cache, "2024-01-01", "2024-01-31")
+    cache_days(cache, "2024-02-01", "2024-02-29")
+
+    frame, missing = cache.read(
+        "AAA", "1d", pd.Timestamp("2024-01-01"), pd.Timestamp("2024-03-31")
+    )
+
+    assert len(frame) == len(daily_bars("2024-01-01", "2024-03-31"))
+    assert missing == []
@@ -0,0 +1,178 @@
+"""HOSE trading calendar, and the gaps it shows in stored bars.
+
+Gap detection lays stored bar counts per (ticker, local day) on a
+ticker x trading-day grid: every trading day between a ticker's first and
+last stored day should hold the calendar's full bar grid, and days well
+short of it are refetched.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from bars import MARKET_TZ
+
+# HOSE sessions in local market time, as [first bar, close) of the 1m bars
+# they produce: continuous matching either side of the lunch break, then
+# the closing auction's single 14:45 bar.
+MARKET_SESSIONS = (("09:15", "11:30"), ("13:00", "14:30"), ("14:45", "14:46"))
+# Weekday market closures, from HOSE's annual holiday notices; add any not
+# listed here with --holiday.
+MARKET_HOLIDAYS = (
+    "2025-01-01",
+    "2025-01-27",
+    "2025-01-28",
+    "2025-01-29",
+    "2025-01-30",
+    "2025-01-31",
+    "2025-04-07",
+    "2025-04-30",
+    "2025-05-01",
+    "2025-05-02",
+    "2025-09-01",
+    "2025-09-02",
+    "2026-01-01",
+    "2026-02-16",
+    "2026-02-17",
+    "2026-02-18",
+    "2026-02-19",
+    "2026-02-20",
+    "2026-04-27",
+    "2026-04-30",
+    "2026-05-01",
+    "2026-09-02",
+)
+# Gap repair refetches a trading day whose stored bars fall below this share
+# of the calendar's bar grid: enough to catch a lost chunk or an outage (both
+# lose whole days) without chasing minutes an illiquid ticker never traded.
+GAP_MIN_FILL = 0.5
+
+
+class TradingCalendar:
+    """HOSE trading days and sessions, in naive local market time."""
+
+    def __init__(
+        self, holidays=MARKET_HOLIDAYS, sessions=MARKET_SESSIONS, weekmask="1111100"
+    ):
+        self.holidays = np.array(sorted(holidays), dtype="datetime64[D]")
+        # Holidays are only known from the first year listed on.
+        self.covered_from = (
+            self.holidays[0].astype("datetime64[Y]").astype("datetime64[D]")
+            if len(self.holidays)
+            else np.datetime64("9999-12-31")
+        )
+        self.weekmask = weekmask
+        self.sessions = [
+            (pd.Timedelta(f"{start}:00"), pd.Timedelta(f"{end}:00"))
+            for start, end in sessions
+        ]
+
+    @staticmethod
+    def now():
+        return pd.Timestamp.now(tz=MARKET_TZ).tz_localize(None)
+
+    def is_trading_day(self, day):
+        return bool(
+            np.is_busday(
+                pd.Timestamp(day).to_datetime64().astype("datetime64[D]"),
+                weekmask=self.weekmask,
+                holidays=self.holidays,
+            )
+        )
+
+    def trading_days(self, start, end):
+        """Trading days in [start, end], as datetime64[D]."""
+        days = np.arange(
+            pd.Timestamp(start).to_datetime64().astype("datetime64[D]"),
+            pd.Timestamp(end).to_datetime64().astype("datetime64[D]") + 1,
+        )
+        return days[np.is_busday(days, weekmask=self.weekmask, holidays=self.holidays)]
+
+    def bars_per_day(self, unit):
+        """Bars a full trading day has at ``unit`` ("m", "h" or "D")."""
+        minutes = np.concatenate(
+            [
+                np.arange(
+                    start // pd.Timedelta(minutes=1), end // pd.Timedelta(minutes=1)
+                )
+                for start, end in self.sessions
+            ]
+        )
+        if unit == "m":
+            return len(minutes)
+        if unit == "h":
+            return len(np.unique(minutes // 60))
+        return 1
+
+    def session_at(self, at, grace=timedelta(0)):
+        """The (open, close) of the session ``at`` falls in, counting
+        ``grace`` past each close, or None if the market is closed."""
+        day = at.normalize()
+        if not self.is_trading_day(day):
+            return None
+        for start, end in self.sessions:
+            if day + start <= at < day + end + grace:
+                return day + start, day + end
+        return None
+
+    def next_open(self, at):
+        """When the next session after ``at`` opens."""
+        day = at.normalize()
+        while True:
+            if self.is_trading_day(day):
+                for start, _ in self.sessions:
+                    if day + start > at:
+                        return day + start
+            day = pd.Timestamp(
+                np.busday_offset(
+                    (day + pd.Timedelta(days=1))
+                    .to_datetime64()
+                    .astype("datetime64[D]"),
+                    0,
+                    roll="forward",
+                    weekmask=self.weekmask,
+                    holidays=self.holidays,
+                )
+            )
+
+
+def gap_windows(tickers, days, counts, calendar, unit, min_fill=GAP_MIN_FILL):
+    """{ticker: [(start, end)]} of past trading days whose bar ``counts``
+    fall below ``min_fill`` of the ``unit`` grid, consecutive days merged."""
+    if not len(days):
+        return {}
+    today = calendar.now().to_datetime64().astype("datetime64[D]")
+    grid_days = calendar.trading_days(days.min(), days.max())
+    grid_days = grid_days[grid_days < today]
+    if not len(grid_days):
+        return {}
+    names = np.unique(tickers)
+    grid = np.zeros((len(names), len(grid_days)), dtype=np.int64)
+    rows = np.searchsorted(names, tickers)
+    cols = np.searchsorted(grid_days, days).clip(max=len(grid_days) - 1)
+    # Bars stamped on non-trading days (or today) aren't on the grid.
+    trading = grid_days[cols] == days
+    grid[rows[trading], cols[trading]] = np.asarray(counts)[trading]
+
+    stored = grid > 0
+    first = stored.argmax(axis=1)
+    last = len(grid_days) - 1 - stored[:, ::-1].argmax(axis=1)
+    index = np.arange(len(grid_days))
+    inside = (index >= first[:, None]) & (index <= last[:, None])
+    inside &= stored.any(axis=1)[:, None]
+    missing = inside & (grid < min_fill * calendar.bars_per_day(unit))
+    # Before the calendar's holidays start, a day no ticker has bars for is
+    # taken as a closure rather than a gap.
+    closed = (grid_days < calendar.covered_from) & ~stored.any(axis=0)
+    missing &= ~closed
+
+    edges = np.diff(np.pad(missing, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)
+    windows = {}
+    for row, start, end in zip(starts[0], starts[1], ends[1] - 1):
+        windows.setdefault(str(names[row]), []).append(
+            (pd.Timestamp(grid_days[start]), pd.Timestamp(grid_days[end]))
+        )
+    return windows